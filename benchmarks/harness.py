@@ -0,0 +1,127 @@
+"""
+Runs every scenario x backend x concurrency workload against a stand-in server and compares the results
+with benchmarks/baselines.json. Exits with 1 when a run is slower, has a worse p99 or a higher peak RSS than
+its baseline by more than --tolerance.
+
+    python -m benchmarks.harness
+    python -m benchmarks.harness --scenarios sites --concurrency 16,64 --save-baseline
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+from benchmarks.workload import DEFAULT_MIX
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COLUMNS = ("scenario", "backend", "concurrency", "targets", "seconds", "targets_per_sec", "p50_ms", "p99_ms",
+           "peak_rss_mb")
+
+
+def start_server(args):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.server", "--port", "0", "--lines", str(args.lines),
+         "--page-kb", str(args.page_kb), "--slow-delay", str(args.slow_delay)],
+        cwd=BASE_DIR, stdout=subprocess.PIPE, text=True)
+    line = server.stdout.readline()
+    if not line.startswith("listening on "):
+        server.kill()
+        raise RuntimeError(f"stand-in server did not start: {line!r}")
+    return server, line.split()[-1]
+
+
+def run_workload(address, scenario, backend, concurrency, args):
+    command = [sys.executable, "-m", "benchmarks.workload", "--server", address, "--scenario", scenario,
+               "--backend", backend, "--concurrency", str(concurrency), "--targets", str(args.targets),
+               "--mix", args.mix]
+    if not args.rate_limit:
+        command.append("--no-rate-limit")
+    completed = subprocess.run(command, cwd=BASE_DIR, capture_output=True, text=True,
+                               env={**os.environ, "HOST_OVERRIDE": address})
+    for line in completed.stdout.splitlines():
+        if line.startswith("BENCH_RESULT "):
+            return json.loads(line[len("BENCH_RESULT "):])
+    raise RuntimeError(f"{scenario}/{backend}/{concurrency} failed:\n{completed.stderr[-2000:]}")
+
+
+def key(result):
+    return f"{result['scenario']}/{result['backend']}/{result['concurrency']}/{result['targets']}"
+
+
+def regressions(result, baseline, tolerance, latency_slack_ms):
+    found = []
+    if result["targets_per_sec"] < baseline["targets_per_sec"] * (1 - tolerance):
+        found.append(f"targets/s {result['targets_per_sec']} < {baseline['targets_per_sec']}")
+    # sub-second percentiles jitter by more than any relative tolerance, hence the absolute slack on top
+    if result["p99_ms"] > baseline["p99_ms"] * (1 + tolerance) + latency_slack_ms:
+        found.append(f"p99_ms {result['p99_ms']} > {baseline['p99_ms']}")
+    if result["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + tolerance):
+        found.append(f"peak_rss_mb {result['peak_rss_mb']} > {baseline['peak_rss_mb']}")
+    return found
+
+
+def print_table(rows):
+    widths = [max(len(column), *(len(str(row[column])) for row in rows)) for column in COLUMNS]
+    print("  ".join(column.rjust(width) for column, width in zip(COLUMNS, widths)))
+    for row in rows:
+        print("  ".join(str(row[column]).rjust(width) for column, width in zip(COLUMNS, widths)))
+
+
+def main(args):
+    results = []
+    for scenario in args.scenarios.split(","):
+        for backend in args.backends.split(","):
+            for concurrency in map(int, args.concurrency.split(",")):
+                print(f"running {scenario}/{backend}/{concurrency} ({args.targets} targets)", flush=True)
+                # a fresh stand-in per run: throttled hosts only answer 429 to the first request they see
+                server, address = start_server(args)
+                try:
+                    results.append(run_workload(address, scenario, backend, concurrency, args))
+                finally:
+                    server.kill()
+                    server.wait()
+    print_table(results)
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+    if args.save_baseline:
+        baselines.update({key(result): {metric: result[metric] for metric in COLUMNS[4:]} for result in results})
+        with open(args.baselines, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"{len(results)} baselines saved to {args.baselines}")
+        return 0
+
+    failed = 0
+    for result in results:
+        baseline = baselines.get(key(result))
+        if not baseline:
+            print(f"{key(result)}: no baseline")
+            continue
+        found = regressions(result, baseline, args.tolerance, args.latency_slack_ms)
+        failed += bool(found)
+        print(f"{key(result)}: {'REGRESSION ' + ', '.join(found) if found else 'ok'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline throughput benchmarks against a local stand-in server")
+    parser.add_argument("--scenarios", default="sites,apps,sync", help="comma separated: sites, apps, sync")
+    parser.add_argument("--backends", default="threads,async", help="comma separated: threads, async")
+    parser.add_argument("--concurrency", default="16,64", help="comma separated pool sizes")
+    parser.add_argument("--targets", type=int, default=1000)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="share of each stand-in host kind")
+    parser.add_argument("--lines", type=int, default=200, help="records per served ads.txt")
+    parser.add_argument("--page-kb", type=int, default=300, help="filler around the store page data, in KB")
+    parser.add_argument("--slow-delay", type=float, default=1.0)
+    parser.add_argument("--no-rate-limit", dest="rate_limit", action="store_false",
+                        help="lift the per host rate limits")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative drift from the baseline")
+    parser.add_argument("--latency-slack-ms", type=float, default=500,
+                        help="p99 drift below this many ms is never a regression")
+    parser.add_argument("--baselines", default=BASELINES_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baselines")
+    sys.exit(main(parser.parse_args()))
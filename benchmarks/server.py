@@ -0,0 +1,174 @@
+"""
+Local stand-in for publishers and the app stores, routed by the Host header (see HOST_OVERRIDE).
+
+    ok-<n>.bench         ads.txt / app-ads.txt with --lines records
+    slow-<n>.bench       the same after --slow-delay seconds
+    timeout-<n>.bench    answers after --timeout-delay seconds, past any sane read timeout
+    throttle-<n>.bench   429 with Retry-After: 1 on the first request for each path, then the file
+    soft404-<n>.bench    200 text/html "not found" page
+    missing-<n>.bench    404
+    play.google.com      /store/apps/details?id=...  details page with a ds:5 block
+    apps.apple.com       /<cc>/app/id<id>            store page with JSON-LD and the developer link list
+    itunes.apple.com     /lookup?id=<id>,<id>        iTunes lookup JSON
+
+App ids carry the developer host they resolve to, see play_app_id / appstore_app_id.
+
+    python -m benchmarks.server --port 8765
+"""
+import re
+import json
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+KINDS = ("ok", "slow", "timeout", "throttle", "soft404", "missing")
+HOST_PATTERN = re.compile(r"^(?P<kind>[a-z0-9]+)-(?P<n>\d+)\.bench$")
+PLAY_ID_PATTERN = re.compile(r"^bench\.(?P<kind>[a-z0-9]+?)(?P<n>\d+)\.app\d+$")
+AD_SYSTEMS = ("google.com", "appnexus.com", "rubiconproject.com", "pubmatic.com", "openx.com", "indexexchange.com",
+              "smaato.com", "inmobi.com", "unity.com", "applovin.com")
+
+
+def play_app_id(kind, dev, seq):
+    return f"bench.{kind}{dev}.app{seq}"
+
+
+def appstore_app_id(kind, dev, seq):
+    return f"9{KINDS.index(kind)}{dev:06d}{seq:03d}"
+
+
+def developer_host(app_id):
+    match = PLAY_ID_PATTERN.match(app_id)
+    if match:
+        return f"{match['kind']}-{int(match['n'])}.bench"
+    if app_id.isdigit() and len(app_id) == 11:
+        return f"{KINDS[int(app_id[1])]}-{int(app_id[2:8])}.bench"
+
+
+def ads_txt(lines):
+    return "".join(f"{AD_SYSTEMS[i % len(AD_SYSTEMS)]}, pub-{i:08d}, {'DIRECT' if i % 3 else 'RESELLER'}, "
+                   f"f08c47fec0942fa0\n" for i in range(lines))
+
+
+def filler(kb):
+    return ("<div class=\"filler\">" + "x" * 1000 + "</div>\n") * kb
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None
+    throttled = set()
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body="", content_type="text/plain; charset=utf-8", headers=None):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        host = (self.headers.get("Host") or "").split(":")[0].lower()
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        try:
+            if host == "play.google.com":
+                return self._play_page(query.get("id", [""])[0])
+            if host == "apps.apple.com":
+                return self._appstore_page(parts.path.rsplit("/id", 1)[-1])
+            if host == "itunes.apple.com":
+                return self._lookup(query.get("id", [""])[0].split(","))
+            return self._publisher(host, parts.path)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _publisher(self, host, path):
+        match = HOST_PATTERN.match(host)
+        kind = match["kind"] if match else "missing"
+        if kind == "slow":
+            time.sleep(self.config.slow_delay)
+        elif kind == "timeout":
+            time.sleep(self.config.timeout_delay)
+        elif kind == "throttle":
+            with self.lock:
+                first = (host, path) not in self.throttled
+                self.throttled.add((host, path))
+            if first:
+                return self._send(429, "Too Many Requests", headers={"Retry-After": "1"})
+        elif kind == "soft404":
+            return self._send(200, "<!DOCTYPE html><html><body>Page not found</body></html>" + self.server.page_filler,
+                              "text/html; charset=utf-8")
+        if kind == "missing" or not path.endswith("ads.txt"):
+            return self._send(404, "Not Found")
+        self._send(200, self.server.ads_txt)
+
+    def _play_page(self, app_id):
+        host = developer_host(app_id)
+        if not host:
+            return self._send(404, "Not Found", "text/html")
+        # google_play_scraper's layout: website at [1][2][69][0][5][2], email at [1][2][69][1][0]
+        developer = [[None] * 5 + [[None, None, f"https://{host}"]], [f"support@{host}"]]
+        data = [None, [None, None, [[f"Bench app {app_id}"]] + [None] * 68 + [developer] +
+                       [None] * 29 + [[[None] * 5 + [[None, None, f"https://{host}/privacy"]]]]]]
+        page = "<!doctype html><html><head>" + self.server.page_filler + \
+               "<script>AF_initDataCallback({key: 'ds:4', hash: '1', data:[1], sideChannel: {}});</script>" \
+               f"<script>AF_initDataCallback({{key: 'ds:5', hash: '7', data:{json.dumps(data)}, sideChannel: {{}}}});" \
+               "</script>" + self.server.page_filler + "</head></html>"
+        self._send(200, page, "text/html; charset=utf-8")
+
+    def _appstore_page(self, app_id):
+        host = developer_host(app_id)
+        if not host:
+            return self._send(404, "Not Found", "text/html")
+        json_ld = json.dumps({"@type": "SoftwareApplication", "name": f"Bench app {app_id}",
+                              "author": {"@type": "Person", "name": "Bench", "url": f"https://{host}"}})
+        page = "<!doctype html><html><head>" \
+               f"<script type=\"application/ld+json\">{json_ld}</script></head><body>" + self.server.page_filler + \
+               f"<ul class=\"inline-list inline-list--app-extensions\"><li><a href=\"https://{host}/\">" \
+               "Developer Website</a></li></ul>" + self.server.page_filler + "</body></html>"
+        self._send(200, page, "text/html; charset=utf-8")
+
+    def _lookup(self, app_ids):
+        results = [{"wrapperType": "software", "trackId": int(app_id), "trackName": f"Bench app {app_id}",
+                    "sellerUrl": f"https://{developer_host(app_id)}"}
+                   for app_id in app_ids if developer_host(app_id)]
+        self._send(200, json.dumps({"resultCount": len(results), "results": results}), "text/javascript")
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # the stand-in takes every connection of a benchmark run, far more than the default backlog of 5
+    request_queue_size = 4096
+
+    def handle_error(self, request, client_address):
+        # clients dropping kept-alive connections at the end of a run are expected
+        pass
+
+
+def serve(port=0, lines=200, page_kb=300, slow_delay=1.0, timeout_delay=5.0):
+    config = argparse.Namespace(slow_delay=slow_delay, timeout_delay=timeout_delay)
+    handler = type("Handler", (StandInHandler,), {"config": config, "throttled": set()})
+    server = StandInServer(("127.0.0.1", port), handler)
+    server.ads_txt = ads_txt(lines)
+    server.page_filler = filler(page_kb)
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stand-in publishers and app stores for the benchmarks")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--lines", type=int, default=200, help="records per ads.txt")
+    parser.add_argument("--page-kb", type=int, default=300, help="filler around the store page data, in KB")
+    parser.add_argument("--slow-delay", type=float, default=1.0)
+    parser.add_argument("--timeout-delay", type=float, default=5.0)
+    args = parser.parse_args()
+    server = serve(args.port, args.lines, args.page_kb, args.slow_delay, args.timeout_delay)
+    print(f"listening on {server.server_address[0]}:{server.server_address[1]}", flush=True)
+    server.serve_forever()
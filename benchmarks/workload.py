@@ -0,0 +1,170 @@
+"""
+One timed run of run_for_sites(), run() or Runner.run() against the stand-in server, in a process of its own
+so peak RSS belongs to that run alone. Every database and result file goes to a temporary directory.
+Ends with a single "BENCH_RESULT {json}" line.
+
+    python -m benchmarks.workload --server 127.0.0.1:8765 --scenario sites --backend threads --concurrency 32
+"""
+import os
+import json
+import time
+import argparse
+import resource
+import tempfile
+import threading
+import contextlib
+from benchmarks.server import KINDS, play_app_id, appstore_app_id
+
+DEFAULT_MIX = "ok=80,slow=5,timeout=2,throttle=5,soft404=4,missing=4"
+SEARCH_COLS = ["google.com, pub-00000001", "pubmatic.com", "appnexus.com, pub-00000011, DIRECT", "example.com"]
+
+
+def parse_mix(mix):
+    """
+    "ok=80,slow=5" -> a deterministic cycle of kinds in those proportions.
+    """
+    weights = {}
+    for part in mix.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in KINDS:
+            raise ValueError(f"unknown host kind {kind}, expected one of {', '.join(KINDS)}")
+        weights[kind] = int(weight)
+    cycle = []
+    while any(weights.values()):
+        for kind in weights:
+            if weights[kind]:
+                cycle.append(kind)
+                weights[kind] -= 1
+    return cycle
+
+
+def site_targets(count, mix):
+    cycle = parse_mix(mix)
+    return [f"{cycle[n % len(cycle)]}-{n}.bench" for n in range(count)]
+
+
+def app_targets(count, mix, apps_per_developer=3):
+    """
+    Half Play Store bundle ids, half App Store ids; apps_per_developer consecutive apps share a developer
+    and therefore an app-ads.txt.
+    """
+    cycle = parse_mix(mix)
+    targets = []
+    for n in range(count):
+        dev = n // apps_per_developer
+        kind = cycle[dev % len(cycle)]
+        targets.append(play_app_id(kind, dev, n) if n % 2 else appstore_app_id(kind, dev, n % 1000))
+    return targets
+
+
+class Timings:
+    """
+    Wall time of every task from its first attempt until the attempt that is not retried.
+    """
+
+    def __init__(self):
+        self._started = {}
+        self._lock = threading.Lock()
+        self.latencies = []
+
+    def wrap(self, fn, key_arg=0):
+        def timed(*args, **kwargs):
+            key = args[key_arg] if isinstance(args[key_arg], (int, str)) else id(args[key_arg])
+            with self._lock:
+                started = self._started.setdefault(key, time.perf_counter())
+            retried = False
+            try:
+                return fn(*args, **kwargs)
+            except RuntimeError as e:
+                retried = is_retried(e, kwargs.get("attempt"))
+                raise
+            finally:
+                if not retried:
+                    with self._lock:
+                        self.latencies.append(time.perf_counter() - started)
+                        del self._started[key]
+        return timed
+
+    def percentile(self, p):
+        if not self.latencies:
+            return 0.0
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(round(p / 100 * (len(latencies) - 1))))]
+
+
+def is_retried(e, attempt):
+    from src.retry import retry_policy
+    return retry_policy.should_retry(e, attempt)
+
+
+def configure(run, workdir, backend, concurrency, rate_limit):
+    for name in dir(run):
+        if name.endswith("_FILE"):
+            setattr(run, name, os.path.join(workdir, os.path.basename(getattr(run, name))))
+    for name in ("CACHE_DB_PATH", "APP_DB_PATH", "INDEX_DB_PATH"):
+        setattr(run, name, os.path.join(workdir, os.path.basename(getattr(run, name))))
+    run.default_max_workers[backend] = concurrency
+    run.default_pipeline_window[backend] = concurrency * 2
+    # every stand-in host is the same socket address, so a per host connection limit would cap the whole run
+    from src.settings import default_async_limits
+    default_async_limits["per_host"] = max(default_async_limits["per_host"], concurrency)
+    if not rate_limit:
+        limiter = run.host_rate_limiter
+        limiter.initial_rate = limiter.max_rate = limiter.burst = 10 ** 6
+
+
+def main(args):
+    os.environ["HOST_OVERRIDE"] = args.server
+    import run
+
+    timings = Timings()
+    with tempfile.TemporaryDirectory(prefix="ads-txt-bench-") as workdir:
+        configure(run, workdir, args.backend, args.concurrency, args.rate_limit)
+        os.makedirs(os.path.join(workdir, "results"), exist_ok=True)
+        quiet = open(os.devnull, "w") if not args.verbose else None
+        with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+            options = {"backend": args.backend, "use_negative_cache": True, "use_variants": True,
+                       "use_change_feed": True}
+            if args.scenario == "sites":
+                targets = site_targets(args.targets, args.mix)
+                run._process_domain = timings.wrap(run._process_domain)
+                started = time.perf_counter()
+                run.run_for_sites(SEARCH_COLS, targets, **options)
+            elif args.scenario == "sync":
+                targets = app_targets(args.targets, args.mix)
+                run.Runner._refresh_app = timings.wrap(run.Runner._refresh_app, key_arg=1)
+                run.Runner._refresh_appstore_batch = timings.wrap(run.Runner._refresh_appstore_batch, key_arg=1)
+                started = time.perf_counter()
+                run.Runner(force=True, fetch_backend=args.backend).run(targets)
+            else:
+                targets = app_targets(args.targets, args.mix)
+                run.Runner(force=True, fetch_backend=args.backend).run(targets)
+                run.process = timings.wrap(run.process)
+                started = time.perf_counter()
+                run.run(SEARCH_COLS, targets, **options)
+            seconds = time.perf_counter() - started
+        if quiet:
+            quiet.close()
+
+    result = {"scenario": args.scenario, "backend": args.backend, "concurrency": args.concurrency,
+              "targets": len(targets), "tasks": len(timings.latencies), "seconds": round(seconds, 3),
+              "targets_per_sec": round(len(targets) / seconds, 2),
+              "p50_ms": round(timings.percentile(50) * 1000, 1), "p99_ms": round(timings.percentile(99) * 1000, 1),
+              "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    print(f"BENCH_RESULT {json.dumps(result)}", flush=True)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="One benchmark run against the stand-in server")
+    parser.add_argument("--server", required=True, help="host:port of benchmarks.server")
+    parser.add_argument("--scenario", choices=["sites", "apps", "sync"], default="sites",
+                        help="sites: run_for_sites(), apps: run() on synced apps, sync: Runner.run()")
+    parser.add_argument("--backend", choices=["threads", "async"], default="threads")
+    parser.add_argument("--concurrency", type=int, default=32, help="pool workers; the pipeline window is twice that")
+    parser.add_argument("--targets", type=int, default=500)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="share of each stand-in host kind")
+    parser.add_argument("--no-rate-limit", dest="rate_limit", action="store_false",
+                        help="lift the per host rate limits so the run is not paced")
+    parser.add_argument("--verbose", action="store_true", help="keep the run's own output")
+    main(parser.parse_args())
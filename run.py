@@ -1,25 +1,46 @@
 import csv
 import os
 import re
+import sys
 from enum import Enum
 
 import psutil
-import sqlite3
 import time
 import urllib.request
 from urllib.parse import parse_qs, urlparse
 import argparse
 
-from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from datetime import datetime as dt
-import extruct
-from bs4 import BeautifulSoup
-from src.extractor import ContentExtractor
+from src.extractor import build_content_extractor
+from src.store_page import extract_store_page
+from src.settings import fetch_backend, default_max_workers, default_pipeline_window, CACHE_DB_PATH, APP_DB_PATH, INDEX_DB_PATH, \
+    SELLERS_PATH, http_cache_max_age, sellers_json_ttl, app_refresh_ttls, negative_cache_intervals, metrics_interval
+from src.http_cache import HttpCache
+from src.negative_cache import NegativeCache
+from src.resolver import VariantResolver, VariantStore
+from src.snapshots import ChangeFeed, SnapshotStore
+from src.db import AppDatabase
+from src.scheduler import RefreshScheduler
+from src.itunes import ItunesBatchLookup
+from src.play_store import PlayStoreDetails
+from src.ratelimit import host_rate_limiter
+from src.metrics import metrics
+from src.errors import is_retryable
+from src.retry import retry_policy
+from src.pipeline import run_pipeline
+from src.matcher import SearchMatcher
+from src.parser import parse_ads_txt
+from src.index import AdsTxtIndex, content_hash
+from src.sellers import SellersIndex, load_sellers, ad_system_domain, declared_accounts, check_seller, DOMAIN_DOWN, \
+    MISSING, NO_DOMAIN
+from src.sellers_verify import SellersVerifier, SellersJsonCache
 from src.scraper import AdsDotTxtScraper
+from src.writer import ResultWriter
+from src.utils import normalize_url
 from google_play_scraper import app
 from google_play_scraper.exceptions import NotFoundError
-from itunes_app_scraper.scraper import AppStoreScraper, AppStoreException
 
 TARGETS_FILE = 'targets.txt'
 SEARCH_FILE = 'searches.txt'
@@ -27,11 +48,19 @@ RESULTS_FILE = f'results/results_{dt.now().strftime("%d_%m_%y")}.csv'
 SITE_RESULTS_FILE = f'results/results_sites_{dt.now().strftime("%d_%m_%y")}.csv'
 FAILED_FILE = f'results/failed_{dt.now().strftime("%d_%m_%y")}.txt'
 SITE_FAILED_FILE = f'results/failed_sites_{dt.now().strftime("%d_%m_%y")}.txt'
+UNVERIFIED_FILE = f'results/unverified_sellers_{dt.now().strftime("%d_%m_%y")}.csv'
+SITE_UNVERIFIED_FILE = f'results/unverified_sellers_sites_{dt.now().strftime("%d_%m_%y")}.csv'
+SELLERS_COVERAGE_FILE = f'results/sellers_coverage_{dt.now().strftime("%d_%m_%y")}.csv'
+CHANGES_FILE = f'results/changes_{dt.now().strftime("%d_%m_%y")}.csv'
+SITE_CHANGES_FILE = f'results/changes_sites_{dt.now().strftime("%d_%m_%y")}.csv'
+METRICS_FILE = f'results/metrics_{dt.now().strftime("%d_%m_%y")}'
+SITE_METRICS_FILE = f'results/metrics_sites_{dt.now().strftime("%d_%m_%y")}'
+SYNC_METRICS_FILE = f'results/metrics_sync_{dt.now().strftime("%d_%m_%y")}'
+JOURNAL_FILE = 'results/.journal_apps'
+SITE_JOURNAL_FILE = 'results/.journal_sites'
 GSHEET_FILE = 'ads_spec.xlsx'
 GSHEET_ID = os.environ.get('GSHEET_ID')
 
-FAILED_RETRY_SECS = 1
-FAILED_RETRY_ATTEMPTS = 0
 
 
 def download_gsheet():
@@ -46,140 +75,247 @@ def read_file_contents(file_path):
         return f.read().splitlines()
 
 
+def iter_file_contents(file_path):
+    with open(file_path) as f:
+        for line in f:
+            yield line.rstrip("\r\n")
+
+
 def read_sheet_contents(sheet_name):
     return pd.read_excel(io=GSHEET_FILE, sheet_name=sheet_name, dtype=str).iloc[:, 0].tolist()
 
 
-def dump_results(results, cols, file_name=RESULTS_FILE):
+def open_results(cols, journal_path, results_file, failed_file, resume=False):
+    fieldnames = ["TARGET", "APP_NAME", "URL", "ADS.TXT", "IS HTTPS?"] + cols + ["REMARKS"]
+    return ResultWriter(journal_path, results_file, failed_file, fieldnames, resume=resume)
+
+
+def dump_unverified(verifier, file_name=UNVERIFIED_FILE):
     with open(file_name, "w", newline="") as csvfile:
-        fieldnames = ["TARGET", "APP_NAME", "URL", "ADS.TXT", "IS HTTPS?"] + cols + ["REMARKS"]
+        fieldnames = ["TARGET", "ADS.TXT", "AD_SYSTEM", "ACCOUNT_ID", "RELATIONSHIP", "STATUS"]
         writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
         writer.writeheader()
-        writer.writerows(results)
+        writer.writerows(verifier.rows)
 
 
-def dump_failures(failed, file_name=FAILED_FILE):
-    with open(file_name, "w", newline="") as f:
-        for i in failed:
-            f.write(i + "\n")
+def run_target(writer, fn, targets, *args, attempt=None):
+    fn(*args, attempt=attempt)
+    for target in targets:
+        writer.mark_done(target)
 
 
-def preprocess(runner, _scraper, line, results, failed, fill_ups, trial=FAILED_RETRY_ATTEMPTS):
-    if not (line and isinstance(line, str) and len(line.strip())):
-        return
+def report_progress(results, what, every=1000, interval=metrics_interval):
+    """
+    Prints a progress line every `every` results and at least every `interval` seconds while results come in.
+    """
+    started = last = time.time()
+    done = 0
+    for done, _ in enumerate(results, 1):
+        now = time.time()
+        if done % every == 0 or now - last >= interval:
+            last = now
+            print(f"{done} {what} done ({done / (now - started):.1f}/s, "
+                  f"rss {psutil.Process().memory_info().rss / 2 ** 20:.0f} MB) {metrics.progress_line()}")
+    metrics.count(what.replace(" ", "_"), done)
+    return done
 
-    status = True
-    _scraped = []
-    _check = None
-    try:
-        # TODO: App store bundle ids whose url has a country code other than "us" won't be available for scraping. Need to pass the full url into the scraper.
-        app_request: AppRequest = runner.build_app_request(line)
-        if not app_request:
-            return
-        app_details = runner.get_app_from_db(app_request)
+
+def dump_metrics(path):
+    metrics.dump(path)
+    print(f"metrics: {metrics.progress_line()}")
+    print(f"metrics written to {path}.json and {path}.prom")
+
+
+def plan_targets(runner, data, writer, fill_ups):
+    """
+    Works out which app-ads.txt every target needs before anything is fetched. Lines are classified once,
+    deduplicated by app_id, resolved through one bulk DB read and grouped by app-ads.txt URL.
+    Returns {a_url: [(line, app_details), ...]}; targets that cannot be fetched are written straight away.
+    """
+    lines = []
+    app_ids = {}
+    for line in data:
+        if not (line and isinstance(line, str) and len(line.strip())) or writer.is_done(line):
+            continue
+        if line not in app_ids:
+            # TODO: App store bundle ids whose url has a country code other than "us" won't be available for scraping. Need to pass the full url into the scraper.
+            with metrics.timer("classify"):
+                app_request: AppRequest = runner.build_app_request(line)
+            app_ids[line] = app_request.app_id if app_request else None
+        if app_ids[line]:
+            lines.append(line)
+
+    with metrics.timer("db_lookup"):
+        apps = runner.db.load_apps(set(app_ids.values()) - {None})
+    groups = {}
+    for line in lines:
+        app_details = apps.get(app_ids[line])
         if not app_details:
-            return
+            continue
         if app_details[7]:
-            _scraped = [line, '-', '-', app_details[7]]
-            raise Exception(app_details[7])
-        _scraped = _scraper.scrape(app_details[0], app_details[1], app_details[2] + '/app-ads.txt')
-        if not _scraped:
-            print(f'Unable to identify target {line}')
-            raise Exception(f'Unable to identify target {line}')
-        _check = _scraped[2]
-    except Exception as e:
-        print(e)
-        status = False
-
-    if not (status and _check):
-        if trial:
-            print(f"Retrying...  {line}  < {FAILED_RETRY_SECS} seconds >")
-            time.sleep(FAILED_RETRY_SECS)
-            return preprocess(_scraper, line, results, failed, fill_ups, trial - 1)
-        if _scraped:
-            results.append(
-                {"TARGET": line, "APP_NAME": _scraped[1], "URL": _scraped[0], "ADS.TXT": "-", "IS HTTPS?": "-",
-                 **fill_ups,
-                 "REMARKS": _scraped[3]})
-        else:
-            results.append(
+            print(app_details[7])
+            writer.results.append(
+                {"TARGET": line, "APP_NAME": "-", "URL": line, "ADS.TXT": "-", "IS HTTPS?": "-", **fill_ups,
+                 "REMARKS": app_details[7]})
+            writer.failed.append(line)
+            writer.mark_done(line)
+            continue
+        if not app_details[2]:
+            writer.results.append(
                 {"TARGET": line, "APP_NAME": "-", "URL": "-", "ADS.TXT": "Failed", "IS HTTPS?": "-", **fill_ups,
                  "REMARKS": "Unable to scrape data."})
-        failed.append(line)
-        return
+            writer.failed.append(line)
+            writer.mark_done(line)
+            continue
+        a_url = app_details[2] + '/app-ads.txt'
+        groups.setdefault(normalize_url(a_url), (a_url, []))[1].append((line, app_details))
+    print(f"planned {len(lines)} targets ({len(apps)} apps) onto {len(groups)} app-ads.txt files")
+    return dict(groups.values())
 
-    return _scraped
 
+def process(_id, _scraper, a_url, targets, results, failed, fill_ups, matcher, default_cols=False, index=None,
+            verifier=None, changes=None, attempt=None):
+    try:
+        _process_group(_id, _scraper, a_url, targets, results, failed, fill_ups, matcher, default_cols, index,
+                       verifier, changes, attempt)
+    except Exception as e:
+        if retry_policy.should_retry(e, attempt):
+            raise
+        # anything unexpected still has to leave a row for every target of the group
+        print(f"Failed to process {a_url}: {e!r}")
+        metrics.error(e)
+        if index:
+            index.remove_targets([line for line, _ in targets])
+        for line, app_details in targets:
+            results.append(
+                {"TARGET": line, "APP_NAME": app_details[1], "URL": app_details[0], "ADS.TXT": "Failed",
+                 "IS HTTPS?": "-", **fill_ups, "REMARKS": "Unable to scrape data."})
+            failed.append(line)
 
-def process(_id, runner, _scraper, line, results, failed, fill_ups, cols, default_cols=False):
-    print(f"Running line no {_id}")
-    # print(
-        # f"CPU: {psutil.cpu_percent()}, MEM_AVAILABLE: {psutil.virtual_memory().available * 100 / psutil.virtual_memory().total}")
 
-    preprocessed = preprocess(runner, _scraper, line, results, failed, fill_ups)
-    if not preprocessed:
-        # continue
+def _process_group(_id, _scraper, a_url, targets, results, failed, fill_ups, matcher, default_cols, index, verifier,
+                   changes, attempt):
+    print(f"Running group no {_id}: {a_url} ({len(targets)} targets)")
+
+    t_url, app_name = targets[0][1][:2]
+    _, _, scraped_data, remarks = _scraper.scrape(t_url, app_name, a_url)
+
+    # transient failures go back to the retry queue instead of being recorded
+    if retry_policy.should_retry(remarks, attempt):
+        raise remarks
+
+    if not scraped_data:
+        print(remarks)
+        if index:
+            index.remove_targets([line for line, _ in targets])
+        for line, app_details in targets:
+            results.append(
+                {"TARGET": line, "APP_NAME": app_details[1], "URL": app_details[0], "ADS.TXT": "-", "IS HTTPS?": "-",
+                 **fill_ups,
+                 "REMARKS": remarks})
+            failed.append(line)
         return
 
-    t_url, app_name, scraped_data, remarks = preprocessed
     is_https, content_type, a_url, content = scraped_data
     if content_type and "text/plain" not in content_type:
-        failed.append(line)
-        results.append(
-            {"TARGET": line, "APP_NAME": "-", "URL": "-", "ADS.TXT": "-", "IS HTTPS?": is_https, **fill_ups,
-             "REMARKS": "Text content not found."})
-        # continue
+        if index:
+            index.remove_targets([line for line, _ in targets])
+        for line, _ in targets:
+            failed.append(line)
+            results.append(
+                {"TARGET": line, "APP_NAME": "-", "URL": "-", "ADS.TXT": "-", "IS HTTPS?": is_https, **fill_ups,
+                 "REMARKS": "Text content not found."})
         return
 
-    splitted_content = [i.strip("\r") for i in content.split("\n") if i.strip()]
+    with metrics.timer("parse"):
+        parsed = parse_ads_txt(content)
+    splitted_content = parsed.lines
     no_of_lines = len(splitted_content)
-
-    if no_of_lines < 5:
-        results.append(
-            {"TARGET": line, "APP_NAME": app_name, "URL": t_url, "ADS.TXT": a_url, "IS HTTPS?": is_https,
-             **fill_ups,
-             "REMARKS": f"{no_of_lines} lines only."})
-        # continue
-        return
-
-    r_dict = {"TARGET": line, "APP_NAME": app_name, "URL": t_url, "ADS.TXT": a_url, "IS HTTPS?": is_https}
-    for i in cols:
-        options = (", ".join(i.lower().split(",")), ",".join(i.lower().split(",")))
-        if default_cols:
-            values = "True" if (
-                    options[0] in str(content).lower() or options[1] in str(content).lower()) else "False"
-        else:
-            values = "; ".join(
-                filter(lambda x: (options[0] in x.lower() or options[1] in x.lower()), splitted_content)) or "-"
-        r_dict[i] = values
-
-    results.append(r_dict)
-
-
-def run_local():
+    digest = content_hash(content)
+    if index:
+        with metrics.timer("index"):
+            for line, app_details in targets:
+                index.update(a_url, parsed, digest, line, app_details[0])
+    if verifier:
+        verifier.report([line for line, _ in targets], a_url, parsed.records)
+
+    # an unchanged file searched for the same columns gets the last run's row values back
+    snapshot = changes and changes.snapshot(a_url)
+    found = changes and changes.previous_found(snapshot, digest)
+    if not found and no_of_lines < 5:
+        found = {**fill_ups, "REMARKS": f"{no_of_lines} lines only."}
+    elif not found:
+        with metrics.timer("search"):
+            found = matcher.search(content, splitted_content, default_cols)
+    if changes:
+        changes.update([line for line, _ in targets], a_url, digest, parsed.records, found, snapshot)
+
+    # one fetch and search per app-ads.txt, spread to every target that points at it
+    for line, app_details in targets:
+        results.append({"TARGET": line, "APP_NAME": app_details[1], "URL": app_details[0], "ADS.TXT": a_url,
+                        "IS HTTPS?": is_https, **found})
+
+
+def run_local(**options):
     cols = read_file_contents(SEARCH_FILE)
-    data = read_file_contents(TARGETS_FILE)
-    run(cols, data)
+    data = iter_file_contents(TARGETS_FILE)
+    run(cols, data, **options)
 
 
-def run_gsheet():
+def run_gsheet(**options):
     download_gsheet()
     cols = read_sheet_contents("search")
     data = read_sheet_contents("targets")
     sites = read_sheet_contents("sites")
-    run(cols, data)
-    run_for_sites(cols, sites)
+    # the apps journal outlives run(): a resume after a kill in the sites phase must not redo the apps
+    run(cols, data, keep_journal=True, **options)
+    run_for_sites(cols, sites, **options)
+    os.remove(JOURNAL_FILE)
+
+
+def get_http_cache(use_http_cache):
+    if use_http_cache:
+        return HttpCache(CACHE_DB_PATH, http_cache_max_age)
+
+
+def get_negative_cache(use_negative_cache):
+    if use_negative_cache:
+        return NegativeCache(CACHE_DB_PATH, negative_cache_intervals)
+
+
+def get_variants(use_variants):
+    if use_variants:
+        return VariantStore(CACHE_DB_PATH)
+
+
+def get_change_feed(use_change_feed, cols, default_cols, file_name):
+    if use_change_feed:
+        search_key = content_hash("\n".join(cols) + str(default_cols))
+        return ChangeFeed(SnapshotStore(CACHE_DB_PATH), file_name, search_key)
+
+
+def get_index(use_index):
+    if use_index:
+        return AdsTxtIndex(INDEX_DB_PATH, APP_DB_PATH)
+
+
+def get_verifier(verify_sellers, extractor):
+    if verify_sellers:
+        return SellersVerifier(extractor, SellersJsonCache(CACHE_DB_PATH, sellers_json_ttl))
 
 def is_valid_domain(domain):
     pattern = r"^(?=.{1,253}$)((?!-)[A-Za-z0-9-]{1,63}(?<!-)\.)+(?!-)[A-Za-z]{2,63}$"
     return re.match(pattern, domain) is not None
 
-def _process_domain(_id, domain, results, failed, fill_ups, cols, extractor):
+def _process_domain(_id, domain, results, failed, fill_ups, matcher, extractor, index=None, verifier=None,
+                    resolver=None, changes=None, attempt=None):
     print(f"Running line no {_id}")
     default_cols = False
     domain = domain.strip()
     print(f"Processing {domain}")
-    if domain and len(domain) > 4 and is_valid_domain(domain):
+    with metrics.timer("classify"):
+        valid = domain and len(domain) > 4 and is_valid_domain(domain)
+    if valid:
         if not domain.startswith("http"):
             domain = f"https://{domain}"
         urlparse_result = urlparse(domain)
@@ -190,30 +326,50 @@ def _process_domain(_id, domain, results, failed, fill_ups, cols, extractor):
                 {"TARGET": domain, "APP_NAME": "-", "URL": "-", "ADS.TXT": "-", "IS HTTPS?": "-", **fill_ups,
                  "REMARKS": "Invalid URL"})
             return
+        indexed = False
         try:
-            is_https, content_type, _url, text = extractor.request_page(f'{domain}/ads.txt')
-            if not text:
-                raise RuntimeError("Empty response")
-
+            a_url = f'{domain}/ads.txt'
+            if resolver:
+                a_url, (is_https, content_type, _url, text) = resolver.fetch(a_url)
+            else:
+                is_https, content_type, _url, text = extractor.request_page(a_url)
             if content_type and "text/plain" not in content_type:
                 raise RuntimeError("Text content not found")
-            splitted_content = [i.strip("\r") for i in text.split("\n") if i.strip()]
+
+            if not text:
+                raise RuntimeError("Empty response")
+            with metrics.timer("parse"):
+                parsed = parse_ads_txt(text)
+            splitted_content = parsed.lines
             no_of_lines = len(splitted_content)
+            digest = content_hash(text)
+            if index:
+                with metrics.timer("index"):
+                    index.update(a_url, parsed, digest, domain)
+                indexed = True
+            if verifier:
+                verifier.report([domain], a_url, parsed.records)
+            snapshot = changes and changes.snapshot(a_url)
+            found = None
+            if no_of_lines >= 5:
+                found = changes and changes.previous_found(snapshot, digest)
+                if not found:
+                    with metrics.timer("search"):
+                        found = matcher.search(text, splitted_content, default_cols)
+            if changes:
+                changes.update([domain], a_url, digest, parsed.records, found, snapshot)
             if no_of_lines < 5:
                 raise RuntimeError(f"{no_of_lines} lines only")
-            r_dict = {"TARGET": domain, "APP_NAME": "-", "URL": domain, "ADS.TXT": f"{domain}/ads.txt",
-                      "IS HTTPS?": is_https}
-            for i in cols:
-                options = (", ".join(i.lower().split(",")), ",".join(i.lower().split(",")))
-                if default_cols:
-                    values = "True" if (
-                            options[0] in str(text).lower() or options[1] in str(text).lower()) else "False"
-                else:
-                    values = "; ".join(
-                        filter(lambda x: (options[0] in x.lower() or options[1] in x.lower()), splitted_content)) or "-"
-                r_dict[i] = values
+            r_dict = {"TARGET": domain, "APP_NAME": "-", "URL": domain, "ADS.TXT": a_url,
+                      "IS HTTPS?": is_https, **found}
             results.append(r_dict)
-        except RuntimeError as e:
+        except Exception as e:
+            if retry_policy.should_retry(e, attempt):
+                raise
+            if not isinstance(e, RuntimeError):
+                metrics.error(e)
+            if index and not indexed:
+                index.remove_targets([domain])
             print(f"Failed to fetch {domain}: {e}")
             failed.append(domain)
             results.append(
@@ -228,42 +384,153 @@ def _process_domain(_id, domain, results, failed, fill_ups, cols, extractor):
              "REMARKS": "Invalid domain"})
 
 
-def run_for_sites(cols, data):
-    results = []
-    failed = []
+def run_for_sites(cols, data, backend=fetch_backend, use_http_cache=True, use_index=True, verify_sellers=False,
+                  resume=False, use_negative_cache=True, use_variants=True, use_change_feed=True):
+    metrics.reset()
+    writer = open_results(cols, SITE_JOURNAL_FILE, SITE_RESULTS_FILE, SITE_FAILED_FILE, resume)
     fill_ups = {i: "-" for i in cols}
 
-    extractor = ContentExtractor()
-    with ThreadPoolExecutor() as pool:
-        futures = []
-        for line_no, line in enumerate(data):
-            futures.append(pool.submit(_process_domain, line_no, line, results, failed, fill_ups, cols, extractor))
-    for future in futures:
-        future.result()
-
-    dump_results(results, cols, file_name=SITE_RESULTS_FILE)
-    dump_failures(failed, file_name=SITE_FAILED_FILE)
-
-
-def run(cols, data):
+    extractor = build_content_extractor(backend, http_cache=get_http_cache(use_http_cache),
+                                        negative_cache=get_negative_cache(use_negative_cache))
+    matcher = SearchMatcher(cols)
+    index = get_index(use_index)
+    verifier = get_verifier(verify_sellers, extractor)
+    variants = get_variants(use_variants)
+    resolver = variants and VariantResolver(extractor, variants)
+    changes = get_change_feed(use_change_feed, cols, False, SITE_CHANGES_FILE)
+    with ThreadPoolExecutor(max_workers=default_max_workers.get(backend)) as pool:
+        tasks = ((run_target, (writer, _process_domain, (line,), line_no, line, writer.results, writer.failed, fill_ups,
+                               matcher, extractor, index, verifier, resolver, changes))
+                 for line_no, line in enumerate(data) if not writer.is_done(line))
+        report_progress(run_pipeline(pool, tasks, window=default_pipeline_window.get(backend)), "sites")
+    if extractor.http_cache:
+        print(f"ads.txt http cache: {extractor.http_cache.stats}")
+    if extractor.negative_cache:
+        print(f"ads.txt negative cache: {extractor.negative_cache.stats}")
+    if resolver:
+        print(f"ads.txt variants: {resolver.stats}")
+        resolver.close()
+    if changes:
+        print(f"ads.txt changes: {changes.stats}")
+        changes.close()
+    extractor.close()
+    if index:
+        index.close()
+    if verifier:
+        dump_unverified(verifier, file_name=SITE_UNVERIFIED_FILE)
+        verifier.cache.close()
+    writer.close()
+    print(f"{writer.written} rows written to {writer.results_file}")
+    dump_metrics(SITE_METRICS_FILE)
+
+
+def run(cols, data, backend=fetch_backend, use_http_cache=True, use_index=True, verify_sellers=False, resume=False,
+        use_negative_cache=True, use_variants=True, use_change_feed=True, keep_journal=False):
     default_cols = False
+    metrics.reset()
 
-    results = []
-    failed = []
+    writer = open_results(cols, JOURNAL_FILE, RESULTS_FILE, FAILED_FILE, resume)
     fill_ups = {i: "-" for i in cols}
 
-    scraper = AdsDotTxtScraper({})
+    scraper = AdsDotTxtScraper({"fetch_backend": backend, "http_cache": get_http_cache(use_http_cache),
+                                "negative_cache": get_negative_cache(use_negative_cache),
+                                "variants": get_variants(use_variants)})
 
-    futures = []
+    matcher = SearchMatcher(cols)
+    index = get_index(use_index)
+    verifier = get_verifier(verify_sellers, scraper.content_extractor)
+    changes = get_change_feed(use_change_feed, cols, default_cols, CHANGES_FILE)
     runner = Runner()
-    with ThreadPoolExecutor() as pool:
-        for line_no, line in enumerate(data):
-            futures.append(
-                pool.submit(process, *(line_no, runner, scraper, line, results, failed, fill_ups, cols, default_cols)))
-    for future in futures:
-        future.result()
-    dump_results(results, cols)
-    dump_failures(failed)
+    groups = plan_targets(runner, data, writer, fill_ups)
+    with ThreadPoolExecutor(max_workers=default_max_workers.get(backend)) as pool:
+        tasks = ((run_target, (writer, process, [line for line, _ in targets], group_no, scraper, a_url, targets,
+                               writer.results, writer.failed, fill_ups, matcher, default_cols, index, verifier,
+                               changes))
+                 for group_no, (a_url, targets) in enumerate(groups.items()))
+        report_progress(run_pipeline(pool, tasks, window=default_pipeline_window.get(backend)), "app-ads.txt files")
+    runner.close()
+    scraper.content_extractor.close()
+    if index:
+        index.close()
+    print(f"app-ads.txt requests: {scraper.flight.stats}")
+    print(f"app-ads.txt cache: {scraper.store.stats}")
+    if scraper.content_extractor.http_cache:
+        print(f"app-ads.txt http cache: {scraper.content_extractor.http_cache.stats}")
+    if scraper.content_extractor.negative_cache:
+        print(f"app-ads.txt negative cache: {scraper.content_extractor.negative_cache.stats}")
+    if scraper.resolver:
+        print(f"app-ads.txt variants: {scraper.resolver.stats}")
+        scraper.resolver.close()
+    if changes:
+        print(f"app-ads.txt changes: {changes.stats}")
+        changes.close()
+    if verifier:
+        dump_unverified(verifier)
+        verifier.cache.close()
+    writer.close(finished=not keep_journal)
+    print(f"{writer.written} rows written to {writer.results_file}")
+    dump_metrics(METRICS_FILE)
+
+
+def _check_seller_domain(scraper, domain, sellers, ad_system, attempt=None):
+    parsed_files, urls, errors = [], [], []
+    for file_name in ("ads.txt", "app-ads.txt"):
+        a_url = f"https://{domain}/{file_name}"
+        _, _, scraped_data, e = scraper.scrape(domain, "-", a_url)
+        if scraped_data and not (scraped_data[1] and "text/plain" not in scraped_data[1]):
+            with metrics.timer("parse"):
+                parsed_files.append(parse_ads_txt(scraped_data[3]))
+            urls.append(a_url)
+        else:
+            errors.append(str(e) if e else "Text content not found")
+
+    rows = []
+    accounts = declared_accounts(parsed_files, ad_system)
+    for seller in sellers:
+        row = {"SELLER_ID": seller.get("seller_id", "-"), "NAME": seller.get("name", "-"), "DOMAIN": domain,
+               "SELLER_TYPE": seller.get("seller_type", "-"), "ADS.TXT": "; ".join(urls) or "-"}
+        if parsed_files:
+            status, found = check_seller(seller, accounts)
+            row.update({"STATUS": status, "FOUND": found or "-", "REMARKS": ""})
+        else:
+            down = all(error.startswith("ConnectionError") for error in errors)
+            row.update({"STATUS": DOMAIN_DOWN if down else MISSING, "FOUND": "-", "REMARKS": "; ".join(errors)})
+        rows.append(row)
+    return rows
+
+
+def run_sellers_coverage(sellers_path=SELLERS_PATH, ad_system=None, backend=fetch_backend, use_http_cache=True,
+                         use_negative_cache=True, use_variants=True):
+    sellers_json = load_sellers(sellers_path)
+    ad_system = (ad_system or ad_system_domain(sellers_json) or "").lower()
+    if not ad_system:
+        raise ValueError('Unable to work out the ad system domain, pass --ad-system')
+    sellers_index = SellersIndex(sellers_json)
+    scraper = AdsDotTxtScraper({"fetch_backend": backend, "http_cache": get_http_cache(use_http_cache),
+                                "negative_cache": get_negative_cache(use_negative_cache),
+                                "variants": get_variants(use_variants)})
+
+    rows = [{"SELLER_ID": seller.get("seller_id", "-"), "NAME": seller.get("name", "-"), "DOMAIN": "-",
+             "SELLER_TYPE": seller.get("seller_type", "-"), "ADS.TXT": "-", "STATUS": NO_DOMAIN, "FOUND": "-",
+             "REMARKS": ""} for seller in sellers_index.without_domain]
+    with ThreadPoolExecutor(max_workers=default_max_workers.get(backend)) as pool:
+        tasks = ((_check_seller_domain, (scraper, domain, sellers, ad_system))
+                 for domain, sellers in sellers_index.by_domain.items())
+        for domain_rows in run_pipeline(pool, tasks, window=default_pipeline_window.get(backend)):
+            rows.extend(domain_rows)
+    if scraper.resolver:
+        scraper.resolver.close()
+    scraper.content_extractor.close()
+
+    with open(SELLERS_COVERAGE_FILE, "w", newline="") as csvfile:
+        fieldnames = ["SELLER_ID", "NAME", "DOMAIN", "SELLER_TYPE", "ADS.TXT", "STATUS", "FOUND", "REMARKS"]
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+    summary = {}
+    for row in rows:
+        summary[row["STATUS"]] = summary.get(row["STATUS"], 0) + 1
+    print(f"sellers.json coverage for {ad_system}: {summary}")
 
 
 class Store(int, Enum):
@@ -345,52 +612,45 @@ class Runner(object):
     def __init__(self, **kwargs):
         self.only_new_apps = kwargs.get('only_new_apps', False)
         self.force = kwargs.get('force', False)
-        self.db_path = 'data/app-ads-txt.db'
-        self.appstore_scraper = AppStoreScraper()
-        self.content_extractor = ContentExtractor()
-
-    def _init_db(self):
-        if not os.path.exists(self.db_path):
-            self._create_tables()
-
-    def _create_tables(self):
-        con = sqlite3.connect(self.db_path)
-        cur = con.cursor()
-        cur.execute(
-            '''CREATE TABLE apps (app_id text PRIMARY KEY NOT NULL, app_name text, app_domain text, store integer NOT NULL, country CHAR(3), language CHAR(3), last_checked_at text NOT NULL, notes text)''')
-        con.commit()
-        con.close()
+        self.fetch_backend = kwargs.get('fetch_backend') or fetch_backend
+        self.db_path = APP_DB_PATH
+        self.db = AppDatabase(self.db_path)
+        self.apps = None
+        self.scheduler = RefreshScheduler(max_requests=kwargs.get('max_requests'),
+                                          time_budget=kwargs.get('time_budget'), **app_refresh_ttls)
+        self.content_extractor = build_content_extractor(self.fetch_backend)
+        self.itunes_lookup = ItunesBatchLookup(self.content_extractor)
+        self.play_store = PlayStoreDetails(self.content_extractor)
+
+    def preload_apps(self):
+        with metrics.timer("db_lookup"):
+            self.apps = self.db.load_apps()
+        print(f"loaded {len(self.apps)} apps from db")
 
     def get_app_from_db(self, app_request):
-        con = sqlite3.connect(self.db_path)
-        cur = con.cursor()
-        cur.execute("SELECT * from apps WHERE app_id=?", (app_request.app_id,))
-        row = cur.fetchone()
-        con.close()
-        return row
+        if self.apps is not None:
+            return self.apps.get(app_request.app_id)
+        return self.db.get_app(app_request.app_id)
 
     def _sync_app_on_db(self, app_response: AppResponse):
-        con = sqlite3.connect(self.db_path)
-        cur = con.cursor()
-        cur.execute(
-            "insert or replace into apps (app_id, app_name, app_domain, store, country, language, last_checked_at, notes) values (?,?,?,?,?,?,?,?);",
-            app_response.as_tuple)
-        con.commit()
-        con.close()
+        row = app_response.as_tuple
+        self.db.upsert(row)
+        if self.apps is not None:
+            self.apps[row[0]] = row
+
+    def close(self):
+        self.db.close()
+        self.content_extractor.close()
 
     def _fetch_fallback_appstore_app_details(self, app_request: AppRequest):
         title, dev_website = None, None
         response = self.content_extractor.request_page(app_request.full_url, text_only=True)
         if response:
-            json_ld = extruct.extract(response, syntaxes=["json-ld"])["json-ld"][0]
+            json_ld, href = extract_store_page(response, developer_link=app_request.store == Store.APPSTORE)
             title = json_ld.get("name")
             if app_request.store == Store.APPSTORE:
-                _soup = BeautifulSoup(response, 'html.parser')
-                _ul = _soup.find('ul', {"class": "inline-list--app-extensions"})
-                if _ul:
-                    el = _ul.findAll('a')
-                    if el:
-                        dev_website = f"https://{urlparse(el[0].get('href')).netloc}"
+                if href:
+                    dev_website = f"https://{urlparse(href).netloc}"
             elif app_request.store == Store.PLAYSTORE:
                 author = json_ld.get("author")
                 if author:
@@ -404,44 +664,127 @@ class Runner(object):
         title, dev_website = None, None
         if app_request.store == Store.PLAYSTORE:
             try:
-                result = app(app_request.app_id, lang=app_request.language, country=app_request.country)
+                # the streamed details page goes through the rate limiter and reports 429s back to it
+                result = self.play_store.lookup(app_request.app_id, lang=app_request.language,
+                                                country=app_request.country)
+                if not result:
+                    print(f"unexpected play store page for {app_request.app_id}, falling back to app()")
+                    host_rate_limiter.acquire('play.google.com')
+                    result = app(app_request.app_id, lang=app_request.language, country=app_request.country)
             except NotFoundError as e:
                 return AppResponse.from_app_request(app_request, notes=str(e))
             if result:
                 title, dev_website = result.get('title'), result.get('developerWebsite') or result.get('privacyPolicy')
         elif app_request.store == Store.APPSTORE:
+            # a lookup of one id, through request_page so the limiter sees iTunes' answers
             try:
-                app_details = self.appstore_scraper.get_app_details(app_request.app_id, country=app_request.country)
-            except AppStoreException as e:
-                return AppResponse.from_app_request(app_request, notes=str(e))
-            if app_details:
-                title, dev_website = app_details.get('trackName'), app_details.get('sellerUrl')
-        if title and dev_website:
-            p_result = urlparse(dev_website)
+                app_details = self.itunes_lookup.lookup([app_request.app_id], app_request.country)
+            except ValueError:
+                return AppResponse.from_app_request(
+                    app_request, notes=f"Could not parse app store response for ID {app_request.app_id}")
+            app_details = app_details.get(app_request.app_id)
+            if not app_details:
+                return AppResponse.from_app_request(app_request, notes=f"No app found with ID {app_request.app_id}")
+            title, dev_website = app_details.get('trackName'), app_details.get('sellerUrl')
+        return self._app_response(app_request, title, dev_website)
+
+    def _app_response(self, app_request: AppRequest, title, dev_website):
+        p_result = dev_website and urlparse(dev_website)
+        # anything without a host, an email address for one, is no developer website
+        if title and p_result and p_result.scheme and p_result.netloc:
             dev_website = f'{p_result.scheme}://{p_result.netloc}'
             return AppResponse.from_app_request(app_request, title, dev_website)
         else:
             return self._fetch_fallback_appstore_app_details(app_request)
 
-    def _sync_app_details_if_required(self, app_request):
-        app_result = self.get_app_from_db(app_request)
-        if app_result:
-            if self.only_new_apps:
-                return
-            if app_result[7] and 'Could not parse app store response for ID' in app_result[7]:
-                print(f'Rechecking existing app {app_request.app_id}')
-            else:
-                # check for expiry if expired fetch again
-                # print(f"app_exists skipping {app_request.app_id}")
-                if not self.force:
-                    return
-        print(f"fetching app details {app_request}")
-        app_response = self._fetch_latest_app_details(app_request)
+    def _fetch_appstore_batch(self, app_requests, attempt=None):
+        try:
+            found = self.itunes_lookup.lookup([r.app_id for r in app_requests], app_requests[0].country)
+        except (RuntimeError, ValueError) as e:
+            if retry_policy.should_retry(e, attempt):
+                raise
+            print(f"itunes lookup failed ({e}), fetching {len(app_requests)} apps one by one")
+            responses = []
+            for app_request in app_requests:
+                try:
+                    responses.append((app_request, self._fetch_latest_app_details(app_request)))
+                except RuntimeError as e:
+                    print(f"failed to fetch app details {app_request.app_id}: {e}")
+            return responses
+
+        responses = []
+        for app_request in app_requests:
+            app_details = found.get(app_request.app_id)
+            try:
+                if app_details:
+                    app_response = self._app_response(app_request, app_details.get('trackName'),
+                                                      app_details.get('sellerUrl'))
+                else:
+                    # ids missing from the lookup get one more chance through the store page
+                    app_response = self._fetch_fallback_appstore_app_details(app_request) or \
+                        AppResponse.from_app_request(app_request, notes=f"No app found with ID {app_request.app_id}")
+            except RuntimeError as e:
+                print(f"failed to fetch app details {app_request.app_id}: {e}")
+                # a transient failure is no verdict on the app, leave it due for the next run
+                keep_note = not (app_details or is_retryable(e))
+                app_response = AppResponse.from_app_request(app_request, notes=str(e)) if keep_note else None
+            responses.append((app_request, app_response))
+        return responses
+
+    def _save_app_response(self, app_request, app_response, previous):
         if app_response:
             self._sync_app_on_db(app_response)
+            if previous:
+                changed = (previous[1], previous[2]) != (app_response.app_name, app_response.app_domain)
+                self.db.record_refresh(app_request.app_id, changed)
         else:
             print(f"failed to receive app_response for {app_request.app_id}")
 
+    def _refresh_app(self, app_request, attempt=None):
+        previous = self.get_app_from_db(app_request)
+        print(f"fetching app details {app_request}")
+        try:
+            with metrics.timer("store_metadata"):
+                app_response = self._fetch_latest_app_details(app_request)
+        except RuntimeError as e:
+            if retry_policy.should_retry(e, attempt):
+                raise
+            print(f"failed to fetch app details {app_request.app_id}: {e}")
+            return
+        self._save_app_response(app_request, app_response, previous)
+
+    def _refresh_appstore_batch(self, app_requests, attempt=None):
+        previous = {app_request.app_id: self.get_app_from_db(app_request) for app_request in app_requests}
+        print(f"fetching app details for {len(app_requests)} apps ({app_requests[0].country})")
+        with metrics.timer("store_metadata"):
+            responses = self._fetch_appstore_batch(app_requests, attempt)
+        for app_request, app_response in responses:
+            self._save_app_response(app_request, app_response, previous[app_request.app_id])
+
+    def _refresh_tasks(self, app_requests):
+        """
+        Yields (fn, arg) refresh tasks: App Store apps are grouped per country into lookup batches,
+        Play Store apps are refreshed one by one.
+        """
+        pending = {}
+        for app_request in app_requests:
+            if app_request.store != Store.APPSTORE:
+                yield self._refresh_app, app_request
+                continue
+            batch = pending.setdefault(app_request.country, [])
+            batch.append(app_request)
+            if len(batch) >= self.itunes_lookup.chunk_size:
+                yield self._refresh_appstore_batch, pending.pop(app_request.country)
+        for batch in pending.values():
+            yield self._refresh_appstore_batch, batch
+
+    def _apps_to_refresh(self, app_requests):
+        if self.force:
+            return app_requests
+        if self.only_new_apps:
+            return [app_request for app_request in app_requests if app_request.app_id not in self.apps]
+        return self.scheduler.due(app_requests, self.apps, self.db.load_volatility())
+
     def build_app_request(self, cell):
         if self.appstore_pat.match(cell):
             country, app_id = self.appstore_pat.search(cell).groups()
@@ -459,36 +802,36 @@ class Runner(object):
             return AppRequest(Store.APPSTORE, cell, 'us', '')
         return
 
-    def run(self):
-        download_gsheet()
-        self._init_db()
-        col = read_sheet_contents("targets")
-        futures = set()
-        completed = 0
-        with ThreadPoolExecutor() as pool:
-            for inx, cell in enumerate(col):
-                if isinstance(cell, str):
-                    cell = cell.strip()
-                else:
+    def _read_app_requests(self, col):
+        app_requests = {}
+        for inx, cell in enumerate(col):
+            if isinstance(cell, str):
+                cell = cell.strip()
+            else:
+                print(f"{inx} - Issue with {cell}")
+                continue
+            if cell:
+                with metrics.timer("classify"):
+                    app_request = self.build_app_request(cell)
+                if not app_request:
                     print(f"{inx} - Issue with {cell}")
                     continue
-                if cell:
-                    app_request = self.build_app_request(cell)
-                    if not app_request:
-                        print(f"{inx} - Issue with {cell}")
-                        continue
-                    if len(futures) >= 1000:
-                        _, futures = wait(futures, return_when=ALL_COMPLETED)
-                        completed += len(_)
-                        print(f"{inx} - completed {completed}")
-                    futures.add(pool.submit(self._sync_app_details_if_required, app_request))
-                    # self._sync_app_details_if_required(app_request)
-            for future in futures:
-                try:
-                    future.result()
-                except Exception as e:
-                    print(f"{inx} - {e}")
-                    break
+                app_requests.setdefault(app_request.app_id, app_request)
+        return list(app_requests.values())
+
+    def run(self, targets=None):
+        metrics.reset()
+        if targets is None:
+            download_gsheet()
+            targets = read_sheet_contents("targets")
+        app_requests = self._read_app_requests(targets)
+        self.preload_apps()
+        with ThreadPoolExecutor(max_workers=default_max_workers.get(self.fetch_backend)) as pool:
+            tasks = ((fn, (arg,)) for fn, arg in self._refresh_tasks(self._apps_to_refresh(app_requests)))
+            report_progress(run_pipeline(pool, tasks, window=default_pipeline_window.get(self.fetch_backend)),
+                            "refresh tasks")
+        self.close()
+        dump_metrics(SYNC_METRICS_FILE)
 
 
 def sync_apps(_args):
@@ -496,7 +839,27 @@ def sync_apps(_args):
 
 
 def ads_txt(_args):
-    run_gsheet()
+    run_gsheet(backend=_args['fetch_backend'], use_http_cache=not _args['no_http_cache'],
+               use_index=not _args['no_index'], verify_sellers=_args['verify_sellers'], resume=_args['resume'],
+               use_negative_cache=not _args['no_negative_cache'], use_variants=not _args['no_variants'],
+               use_change_feed=not _args['no_change_feed'])
+
+
+def sellers_coverage(_args):
+    run_sellers_coverage(_args['sellers'], _args['ad_system'], backend=_args['fetch_backend'],
+                         use_http_cache=not _args['no_http_cache'],
+                         use_negative_cache=not _args['no_negative_cache'], use_variants=not _args['no_variants'])
+
+
+def query(_args):
+    index = AdsTxtIndex(INDEX_DB_PATH, APP_DB_PATH)
+    started = time.time()
+    rows = index.query(_args['ad_system'], _args['account_id'], _args['relationship'], _args['limit'])
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["AD_SYSTEM", "ACCOUNT_ID", "RELATIONSHIP", "ADS.TXT", "TARGET", "APP_ID", "APP_NAME"])
+    writer.writerows(rows)
+    print(f"{len(rows)} rows in {(time.time() - started) * 1000:.1f} ms", file=sys.stderr)
+    index.close()
 
 
 def run_sites(_args):
@@ -513,9 +876,51 @@ if __name__ == '__main__':
                                   default=os.getenv('FORCE', False))
     sync_apps_parser.add_argument('--only-new-apps', action='store_true', help='sync only new apps',
                                   default=os.getenv('ONLY_NEW_APPS', False))
+    sync_apps_parser.add_argument('--max-requests', type=int, default=os.getenv('SYNC_MAX_REQUESTS'),
+                                  help='refresh at most this many known apps in this run')
+    sync_apps_parser.add_argument('--time-budget', type=int, default=os.getenv('SYNC_TIME_BUDGET'),
+                                  help='stop scheduling refreshes after this many seconds')
+    sync_apps_parser.add_argument('--fetch-backend', choices=['threads', 'async'], default=fetch_backend,
+                                  help='http backend used for page requests')
 
     index_all_parser = subparsers.add_parser('ads_txt', help='Checks app-ads.txt')
     index_all_parser.set_defaults(func=ads_txt)
+    index_all_parser.add_argument('--fetch-backend', choices=['threads', 'async'], default=fetch_backend,
+                                  help='http backend used for page requests')
+    index_all_parser.add_argument('--no-http-cache', action='store_true',
+                                  help='skip the persistent ads.txt cache and download every file')
+    index_all_parser.add_argument('--no-negative-cache', action='store_true',
+                                  help='probe every target again, including ones known to be failing')
+    index_all_parser.add_argument('--no-variants', action='store_true',
+                                  help='only fetch the file where it is expected, without www / http / root domain fallbacks')
+    index_all_parser.add_argument('--no-change-feed', action='store_true',
+                                  help='search every file again and do not diff it against the previous run')
+    index_all_parser.add_argument('--no-index', action='store_true', help='do not update the ads.txt index')
+    index_all_parser.add_argument('--verify-sellers', action='store_true',
+                                  help="check every ads.txt line against the ad system's sellers.json")
+    index_all_parser.add_argument('--resume', action='store_true',
+                                  help='continue an interrupted run, skipping targets that were already written')
+
+    coverage_parser = subparsers.add_parser('sellers_coverage',
+                                            help='Checks sellers.json entries against the sellers ads.txt')
+    coverage_parser.set_defaults(func=sellers_coverage)
+    coverage_parser.add_argument('--sellers', default=SELLERS_PATH, help='sellers.json to check')
+    coverage_parser.add_argument('--ad-system', help='our ad system domain, defaults to the contact_email domain')
+    coverage_parser.add_argument('--fetch-backend', choices=['threads', 'async'], default=fetch_backend,
+                                 help='http backend used for page requests')
+    coverage_parser.add_argument('--no-http-cache', action='store_true',
+                                 help='skip the persistent ads.txt cache and download every file')
+    coverage_parser.add_argument('--no-negative-cache', action='store_true',
+                                 help='probe every domain again, including ones known to be failing')
+    coverage_parser.add_argument('--no-variants', action='store_true',
+                                 help='only fetch the file where it is expected, without www / http / root domain fallbacks')
+
+    query_parser = subparsers.add_parser('query', help='Looks up ads.txt lines in the index')
+    query_parser.set_defaults(func=query)
+    query_parser.add_argument('ad_system', help='ad system domain, e.g. pubmatic.com')
+    query_parser.add_argument('--account-id', help='seller / publisher account id')
+    query_parser.add_argument('--relationship', choices=['DIRECT', 'RESELLER', 'direct', 'reseller'])
+    query_parser.add_argument('--limit', type=int)
 
     args = parser.parse_args()
     args.func(vars(args))
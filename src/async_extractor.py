@@ -0,0 +1,135 @@
+import time
+import errno
+import socket
+import asyncio
+import threading
+import aiohttp
+from multidict import CIMultiDict
+from src.errors import FetchError
+from src.metrics import metrics
+from src.extractor import ContentExtractor, BodyReader, is_plain_text, route
+from src.settings import default_request_timeouts, default_async_limits, max_ads_txt_bytes, host_override
+
+
+class TimedResolver(aiohttp.DefaultResolver):
+    """
+    aiohttp's resolver with a deadline: sock_connect only starts once the name resolved, so without one a
+    stalled DNS server holds a request forever. A lookup running out of time is a transient connect failure.
+    """
+
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        try:
+            return await asyncio.wait_for(super().resolve(host, port, family), self.timeout)
+        except asyncio.TimeoutError:
+            raise OSError(errno.ETIMEDOUT, f"DNS lookup timed out after {self.timeout}s") from None
+
+
+class AsyncContentExtractor(ContentExtractor):
+    """
+    ContentExtractor backed by a single asyncio event loop running on a daemon thread.
+    request_page keeps its blocking contract; the loop multiplexes every in-flight request
+    over one pooled keep-alive session capped globally and per host.
+    """
+
+    def __init__(self, request_timeouts=default_request_timeouts, http_cache=None, limits=default_async_limits,
+                 negative_cache=None):
+        super().__init__(request_timeouts, http_cache=http_cache, negative_cache=negative_cache)
+        self.limits = limits
+        self.dns_timeout = request_timeouts.get("dns", request_timeouts["connect"])
+        self.max_in_flight = limits["connections"]
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="async-extractor", daemon=True)
+        self._thread.start()
+        self._session = self._run(self._create_session())
+
+    async def _create_session(self):
+        connect, read = self.request_timeouts
+        connector = aiohttp.TCPConnector(
+            limit=self.limits["connections"],
+            limit_per_host=self.limits["per_host"],
+            keepalive_timeout=self.limits["keepalive"],
+            ttl_dns_cache=300,
+            resolver=TimedResolver(self.dns_timeout),
+        )
+        # total=None: waiting for a free slot in the pool must not count against the request;
+        # the name lookup is bounded by TimedResolver and the TCP/TLS handshake by sock_connect
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect, sock_read=read)
+        return aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=[self._trace_config()])
+
+    @staticmethod
+    def _trace_config():
+        """
+        DNS, connect and time to first byte of every request, measured by aiohttp itself.
+        DNS and connect only show up when the resolver cache or the keep-alive pool missed.
+        """
+        trace = aiohttp.TraceConfig()
+
+        def start(mark):
+            async def on_start(session, context, params):
+                setattr(context, mark, time.perf_counter())
+            return on_start
+
+        def end(mark, stage):
+            async def on_end(session, context, params):
+                metrics.observe(stage, time.perf_counter() - getattr(context, mark))
+            return on_end
+
+        trace.on_dns_resolvehost_start.append(start("dns"))
+        trace.on_dns_resolvehost_end.append(end("dns", "dns"))
+        trace.on_connection_create_start.append(start("connect"))
+        trace.on_connection_create_end.append(end("connect", "connect"))
+        trace.on_request_start.append(start("request"))
+        trace.on_request_end.append(end("request", "ttfb"))
+        return trace
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def fetch(self, url, headers, stream=False):
+        wire_url, headers = route(url, headers)
+        try:
+            async with self._session.get(wire_url, headers=headers, allow_redirects=True) as response:
+                final_url = url if host_override else str(response.url)
+                started = time.perf_counter()
+                headers, text = await self._read(response, stream)
+                metrics.observe("body", time.perf_counter() - started)
+                return response.status, final_url, headers, text
+        except aiohttp.ClientSSLError as e:
+            # ahead of ClientConnectorError: certificate errors subclass it but carry no os_error
+            raise FetchError.from_connection_error(e, dns_failure=False, tls_failure=True)
+        except aiohttp.ClientConnectorError as e:
+            raise FetchError.from_connection_error(e, dns_failure=isinstance(e.os_error, socket.gaierror))
+        except aiohttp.ServerTimeoutError as e:
+            # sock_connect expiring is reported as "Connection timeout to host ..."
+            raise FetchError.from_connection_error(e, connect_timeout=str(e).startswith("Connection timeout"))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise FetchError.from_connection_error(e)
+
+    @staticmethod
+    async def _read(response, stream):
+        if not stream:
+            return response.headers, await response.text(errors="replace")
+        if response.status != 200 or not is_plain_text(response.headers.get("Content-Type")):
+            return response.headers, ""
+        if (response.content_length or 0) > max_ads_txt_bytes:
+            raise FetchError("Response too large")
+        reader = BodyReader(response.charset)
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            if not reader.feed(chunk):
+                headers = CIMultiDict(response.headers)
+                headers["Content-Type"] = "text/html"
+                return headers, ""
+        return response.headers, reader.text
+
+    def _fetch(self, url, headers, stream=False):
+        return self._run(self.fetch(url, headers, stream))
+
+    def close(self):
+        super().close()
+        self._run(self._session.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
@@ -0,0 +1,97 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class BodyCache:
+    """
+    Thread-safe LRU of fetched ads.txt responses, bounded by entry count and decoded body size.
+    Values are either (is_https, content_type, text, url) or the RuntimeError the fetch raised.
+    When spill_dir is set, evicted entries are written there and promoted back on their next hit.
+    """
+
+    def __init__(self, max_entries, max_bytes, spill_dir=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.spills = 0
+
+    @staticmethod
+    def _size(value):
+        if isinstance(value, Exception):
+            return len(str(value))
+        return len(value[2])
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, f"{hashlib.md5(key.encode()).hexdigest()}.json")
+
+    def _spill(self, key, value):
+        if isinstance(value, Exception):
+            payload = {"error": str(value)}
+        else:
+            payload = {"response": list(value)}
+        os.makedirs(self.spill_dir, exist_ok=True)
+        with open(self._spill_path(key), "w") as fp:
+            json.dump(payload, fp)
+        self.spills += 1
+
+    def _load_spilled(self, key):
+        try:
+            with open(self._spill_path(key)) as fp:
+                payload = json.load(fp)
+        except (OSError, ValueError):
+            return
+        if "error" in payload:
+            return RuntimeError(payload["error"])
+        return tuple(payload["response"])
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            key, value = self._entries.popitem(last=False)
+            self._bytes -= self._size(value)
+            self.evictions += 1
+            if self.spill_dir:
+                self._spill(key, value)
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+        value = self.spill_dir and self._load_spilled(key)
+        if value is None:
+            with self._lock:
+                self.misses += 1
+            return
+        with self._lock:
+            self.disk_hits += 1
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= self._size(previous)
+            self._entries[key] = value
+            self._bytes += self._size(value)
+            self._evict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def stats(self):
+        return {"entries": len(self._entries), "bytes": self._bytes, "hits": self.hits, "disk_hits": self.disk_hits,
+                "misses": self.misses, "evictions": self.evictions, "spills": self.spills}
@@ -0,0 +1,134 @@
+import time
+import queue
+import threading
+from src.sqlite_store import SqliteStore
+
+_STOP = object()
+
+
+class AppDatabase(SqliteStore):
+    """
+    Access layer for the apps table in data/app-ads-txt.db.
+    Reads use per-thread connections; upserts are queued to a single writer thread that commits
+    every batch_size rows or flush_interval seconds. Queued rows are visible to get_app right away.
+    A batch that fails to commit is logged and the writer keeps going; flush and close raise the first such
+    error so the loss does not go unnoticed.
+    """
+    schema = (
+        '''CREATE TABLE IF NOT EXISTS apps (app_id text PRIMARY KEY NOT NULL, app_name text, app_domain text, store integer NOT NULL, country CHAR(3), language CHAR(3), last_checked_at text NOT NULL, notes text)''',
+        '''CREATE INDEX IF NOT EXISTS apps_last_checked_at ON apps (last_checked_at)''',
+        '''CREATE INDEX IF NOT EXISTS apps_store ON apps (store)''',
+        '''CREATE TABLE IF NOT EXISTS app_refreshes (app_id text PRIMARY KEY NOT NULL, refreshes integer NOT NULL DEFAULT 0, changes integer NOT NULL DEFAULT 0)''',
+    )
+    upsert_sql = "insert or replace into apps (app_id, app_name, app_domain, store, country, language, last_checked_at, notes) values (?,?,?,?,?,?,?,?);"
+    refresh_sql = "insert into app_refreshes (app_id, refreshes, changes) values (?, 1, ?) on conflict(app_id) do update set refreshes = refreshes + 1, changes = changes + excluded.changes;"
+
+    def __init__(self, db_path, batch_size=500, flush_interval=1.0):
+        super().__init__(db_path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._error = None
+        self._writer = threading.Thread(target=self._write_loop, name="app-db-writer", daemon=True)
+        self._writer.start()
+
+    def get_app(self, app_id):
+        with self._pending_lock:
+            row = self._pending.get(app_id)
+        if row:
+            return row
+        return self.connection.execute("SELECT * from apps WHERE app_id=?", (app_id,)).fetchone()
+
+    def load_apps(self, app_ids=None, chunk_size=900):
+        con = self.connection
+        if app_ids is None:
+            rows = con.execute("SELECT * from apps").fetchall()
+        else:
+            app_ids = list(app_ids)
+            rows = []
+            for i in range(0, len(app_ids), chunk_size):
+                chunk = app_ids[i:i + chunk_size]
+                rows.extend(con.execute(
+                    f"SELECT * from apps WHERE app_id IN ({','.join('?' * len(chunk))})", chunk).fetchall())
+        apps = {row[0]: row for row in rows}
+        wanted = None if app_ids is None else set(app_ids)
+        with self._pending_lock:
+            apps.update({app_id: row for app_id, row in self._pending.items() if wanted is None or app_id in wanted})
+        return apps
+
+    def load_volatility(self):
+        return dict(self.connection.execute("SELECT app_id, changes FROM app_refreshes").fetchall())
+
+    def upsert(self, row):
+        with self._pending_lock:
+            self._pending[row[0]] = row
+        self._queue.put((self.upsert_sql, row))
+
+    def record_refresh(self, app_id, changed):
+        self._queue.put((self.refresh_sql, (app_id, int(changed))))
+
+    def _commit(self, batch):
+        statements = {}
+        for sql, row in batch:
+            statements.setdefault(sql, []).append(row)
+        with self.connection as con:
+            for sql, rows in statements.items():
+                con.executemany(sql, rows)
+        with self._pending_lock:
+            for row in statements.get(self.upsert_sql, []):
+                if self._pending.get(row[0]) is row:
+                    del self._pending[row[0]]
+
+    def _commit_batch(self, batch):
+        try:
+            self._commit(batch)
+        except Exception as e:
+            print(f"Failed to write {len(batch)} rows to {self.db_path}: {e!r}")
+            self._error = self._error or e
+
+    def _raise_error(self):
+        error, self._error = self._error, None
+        if error:
+            raise error
+
+    def _write_loop(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = max(0, deadline - time.monotonic()) if batch else None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                break
+            if isinstance(item, threading.Event):
+                if batch:
+                    self._commit_batch(batch)
+                    batch = []
+                item.set()
+                continue
+            if item is not None:
+                batch.append(item)
+                if len(batch) == 1:
+                    deadline = time.monotonic() + self.flush_interval
+            if batch and (item is None or len(batch) >= self.batch_size):
+                self._commit_batch(batch)
+                batch = []
+        if batch:
+            self._commit_batch(batch)
+
+    def flush(self):
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+        self._raise_error()
+
+    def close(self):
+        if self._writer.is_alive():
+            self._queue.put(_STOP)
+            self._writer.join()
+        super().close()
+        self._raise_error()
@@ -0,0 +1,36 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class DelayQueue:
+    """
+    Thread-safe heap of items that become ready after a delay.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def push(self, item, delay):
+        with self._lock:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), item))
+
+    def pop_ready(self):
+        now = time.monotonic()
+        ready = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                ready.append(heapq.heappop(self._heap)[2])
+        return ready
+
+    def next_delay(self):
+        with self._lock:
+            if not self._heap:
+                return
+            return max(0.0, self._heap[0][0] - time.monotonic())
+
+    def __len__(self):
+        return len(self._heap)
@@ -0,0 +1,39 @@
+DNS_FAILURE_MARKERS = ("NameResolutionError", "Name or service not known", "nodename nor servname",
+                       "getaddrinfo failed", "No address associated with hostname")
+
+
+DNS_FAILURE = "dns"
+CONNECT_TIMEOUT = "connect_timeout"
+NOT_FOUND = "not_found"
+NON_TEXT = "non_text"
+
+
+class FetchError(RuntimeError):
+    """
+    Failed page request. The message is what ends up in the REMARKS column; retryable tells
+    whether asking again later can succeed (timeouts, resets, 5xx, throttling) or not (404, DNS, TLS).
+    failure names the persistent failure classes the negative cache remembers, None for the rest.
+    """
+
+    def __init__(self, message, status_code=None, retryable=False, failure=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retryable = retryable
+        self.failure = failure
+
+    @classmethod
+    def from_status(cls, message, status_code):
+        return cls(message, status_code, retryable=status_code == 429 or status_code >= 500,
+                   failure=NOT_FOUND if status_code in (404, 410) else None)
+
+    @classmethod
+    def from_connection_error(cls, e, dns_failure=None, connect_timeout=False, tls_failure=False):
+        if dns_failure is None:
+            dns_failure = any(marker in str(e) for marker in DNS_FAILURE_MARKERS)
+        failure = DNS_FAILURE if dns_failure else CONNECT_TIMEOUT if connect_timeout else None
+        # a bad certificate or handshake fails the same way on every retry
+        return cls(f"ConnectionError {e}", retryable=not (dns_failure or tls_failure), failure=failure)
+
+
+def is_retryable(error):
+    return isinstance(error, FetchError) and error.retryable
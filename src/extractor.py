@@ -1,50 +1,275 @@
 import re
-import extruct
+import time
+import codecs
 import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urlparse
-from src.settings import ua, default_request_timeouts
-from requests.exceptions import ReadTimeout, ConnectTimeout, ConnectionError
+from urllib.parse import urlparse, urlsplit, urlunsplit
+from requests.adapters import HTTPAdapter
+from src.settings import ua, default_request_timeouts, fetch_backend, max_ads_txt_bytes, host_override
+from src.errors import FetchError, NON_TEXT
+from src.store_page import extract_store_page
+from src.ratelimit import HostThrottled, host_rate_limiter
+from src.metrics import metrics
+from requests.exceptions import ReadTimeout, ConnectTimeout, ConnectionError, ChunkedEncodingError, SSLError
 from itunes_app_scraper.scraper import AppStoreScraper
 
+HTML_MARKERS = ("<!doctype html", "<html", "<head", "<body", "<?xml")
+
+
+def route(url, headers):
+    """
+    Where a request for url actually goes. With host_override set it is sent there over plain http,
+    carrying the original host in the Host header.
+    """
+    if not host_override:
+        return url, headers
+    parts = urlsplit(url)
+    return urlunsplit(("http", host_override, parts.path or "/", parts.query, "")), {**headers, "Host": parts.netloc}
+
+
+def is_plain_text(content_type):
+    # a missing Content-Type is given the benefit of the doubt, like the callers do
+    return not content_type or "text/plain" in content_type
+
+
+class BodyReader:
+    """
+    Decodes an ads.txt body chunk by chunk, gives up as soon as the first chunk turns out to be
+    HTML and refuses to hold more than max_bytes.
+    """
+
+    def __init__(self, encoding, max_bytes=max_ads_txt_bytes):
+        try:
+            self.decoder = codecs.getincrementaldecoder(encoding or "utf-8")(errors="replace")
+        except LookupError:
+            self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.parts = []
+        self.sniffed = False
+        self.html = False
+
+    def feed(self, chunk):
+        """
+        Returns False once the rest of the body is not worth reading.
+        """
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise FetchError("Response too large")
+        text = self.decoder.decode(chunk)
+        if not self.sniffed and text.strip():
+            self.sniffed = True
+            self.html = text.lstrip("\ufeff \t\r\n")[:32].lower().startswith(HTML_MARKERS)
+            if self.html:
+                return False
+        self.parts.append(text)
+        return True
+
+    @property
+    def text(self):
+        if self.html:
+            return ""
+        return "".join(self.parts) + self.decoder.decode(b"", final=True)
+
+
 class ContentExtractor:
+    # requests this backend can have on the wire at once, None when only the calling threads bound it
+    max_in_flight = None
 
-    def __init__(self, request_timeouts=default_request_timeouts):
+    def __init__(self, request_timeouts=default_request_timeouts, http_cache=None, rate_limiter=host_rate_limiter,
+                 negative_cache=None):
         self.request_timeouts = request_timeouts["connect"], request_timeouts["read"]
+        self.http_cache = http_cache
+        self.negative_cache = negative_cache
+        self.rate_limiter = rate_limiter
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=64, pool_maxsize=64))
+        self.session.mount("https://", HTTPAdapter(pool_connections=64, pool_maxsize=64))
+
+    def _fetch(self, url, headers, stream=False):
+        """
+        Performs the GET and returns (status_code, final_url, headers, text).
+        With stream=True only a 200 plain text body is read, through BodyReader; anything else comes back
+        with an empty body, and a body sniffed as HTML is reported with a text/html Content-Type.
+        Transport errors are raised as FetchError.
+        """
+        wire_url, headers = route(url, headers)
+        started = time.perf_counter()
+        try:
+            response = self.session.get(
+                wire_url, allow_redirects=True,
+                headers=headers,
+                timeout=self.request_timeouts,
+                stream=stream
+            )
+            # requests only times the response headers, so DNS and connect are part of ttfb on this backend
+            ttfb = response.elapsed.total_seconds()
+            metrics.observe("ttfb", ttfb)
+            final_url = url if host_override else response.url
+            text = self._read(response, stream)
+            metrics.observe("body", max(0.0, time.perf_counter() - started - ttfb))
+            return response.status_code, final_url, response.headers, text
+        except (ReadTimeout, ConnectTimeout, ConnectionError, ChunkedEncodingError) as e:
+            raise FetchError.from_connection_error(e, connect_timeout=isinstance(e, ConnectTimeout),
+                                                   tls_failure=isinstance(e, SSLError))
+
+    @staticmethod
+    def _read(response, stream):
+        if not stream:
+            return response.text
+        with response:
+            if response.status_code != 200 or not is_plain_text(response.headers.get("Content-Type")):
+                return ""
+            if int(response.headers.get("Content-Length") or 0) > max_ads_txt_bytes:
+                raise FetchError("Response too large")
+            reader = BodyReader(response.encoding)
+            for chunk in response.iter_content(64 * 1024):
+                if not reader.feed(chunk):
+                    response.headers["Content-Type"] = "text/html"
+                    break
+            return reader.text
+
+    @staticmethod
+    def _status_message(url, status_code):
+        if status_code == 429:
+            return 'Rate Limit Exceeded'
+        elif status_code == 404:
+            if url.find('ads.txt') > -1:
+                return 'Ads.txt Not Found'
+            return 'App Not Found'
+        return f'NA - {status_code}'
+
+    @staticmethod
+    def _from_cache_entry(entry):
+        _url = entry["final_url"]
+        return _url.startswith("https://"), entry["content_type"], _url, entry["text"]
 
     def request_page(self, url, text_only=False):
+        # only ads.txt requests (tuple responses) go through the persistent cache, store pages don't
+        use_cache = self.http_cache is not None and not text_only
+        entry = use_cache and self.http_cache.get(url)
+        request_headers = {"User-Agent": ua.random}
+        if entry:
+            if self.http_cache.is_fresh(entry):
+                self.http_cache.fresh_hits += 1
+                return self._from_cache_entry(entry)
+            request_headers.update(self.http_cache.conditional_headers(entry))
+
+        negative_cache = self.negative_cache if not text_only else None
+        known_failure = negative_cache and negative_cache.get(url)
+        if known_failure and not negative_cache.is_due(known_failure):
+            negative_cache.hit(known_failure)
+            if known_failure["failure"] == NON_TEXT:
+                return url.startswith("https://"), known_failure["content_type"], url, ""
+            raise FetchError(known_failure["message"], failure=known_failure["failure"])
+
+        host = urlparse(url).netloc
+        try:
+            if self.rate_limiter:
+                self.rate_limiter.acquire(host)
+        except HostThrottled as e:
+            metrics.error(e)
+            raise
         print(f"Fetching...  {url}")
+        metrics.count("requests")
+        started = time.monotonic()
         try:
-            response = requests.get(
-                url, allow_redirects=True,
-                headers={"User-Agent": ua.random},
-                timeout=self.request_timeouts
-            )
-        except (ReadTimeout, ConnectTimeout, ConnectionError) as e:
-            raise RuntimeError(f"ConnectionError {e}")
-
-        if response.status_code != 200:
-            if response.status_code == 429:
-                message = 'Rate Limit Exceeded'
-            elif response.status_code == 404:
-                if url.find('ads.txt') > -1:
-                    message = 'Ads.txt Not Found'
-                else:
-                    message = 'App Not Found'
-            else:
-                message = f'NA - {response.status_code}'
-            raise RuntimeError(f"{message}")
-
-        text = response.text
+            status_code, _url, headers, text = self._fetch(url, request_headers, stream=not text_only)
+        except FetchError as e:
+            metrics.error(e)
+            if negative_cache and e.failure:
+                negative_cache.record(url, e.failure, str(e), time.monotonic() - started)
+            raise
+        if self.rate_limiter:
+            retry_after = self.rate_limiter.feedback(host, status_code, headers.get("Retry-After"))
+            if retry_after is not None:
+                error = HostThrottled(host, retry_after, self._status_message(url, status_code))
+                metrics.error(error)
+                raise error
+
+        if status_code == 304 and entry:
+            self.http_cache.revalidated += 1
+            self.http_cache.touch(url)
+            return self._from_cache_entry(entry)
+
+        if status_code != 200:
+            error = FetchError.from_status(self._status_message(url, status_code), status_code)
+            metrics.error(error)
+            if negative_cache and error.failure:
+                negative_cache.record(url, error.failure, str(error), time.monotonic() - started)
+            raise error
+
         if text_only:
             return text
 
-        _url = response.url
         is_https = _url.startswith("https://")
-        content_type = response.headers.get("Content-Type")
+        content_type = headers.get("Content-Type")
+        if negative_cache:
+            if not is_plain_text(content_type):
+                negative_cache.record(url, NON_TEXT, "Text content not found.", time.monotonic() - started,
+                                      content_type)
+            elif known_failure:
+                negative_cache.clear(url)
+        if use_cache:
+            self.http_cache.misses += 1
+            if content_type and "text/plain" in content_type:
+                self.http_cache.put(url, _url, content_type, headers.get("ETag"), headers.get("Last-Modified"), text)
 
         return is_https, content_type, _url, text
 
+    def iter_page(self, url, chunk_size=64 * 1024):
+        """
+        Streams a page as decoded text chunks without holding the whole body in memory.
+        Goes through the host's rate limiter both ways, like request_page.
+        """
+        host = urlparse(url).netloc
+        if self.rate_limiter:
+            try:
+                self.rate_limiter.acquire(host)
+            except HostThrottled as e:
+                metrics.error(e)
+                raise
+        print(f"Streaming...  {url}")
+        wire_url, headers = route(url, {"User-Agent": ua.random})
+        try:
+            with self.session.get(wire_url, allow_redirects=True, headers=headers,
+                                  timeout=self.request_timeouts, stream=True) as response:
+                metrics.observe("ttfb", response.elapsed.total_seconds())
+                if self.rate_limiter:
+                    retry_after = self.rate_limiter.feedback(host, response.status_code,
+                                                             response.headers.get("Retry-After"))
+                    if retry_after is not None:
+                        error = HostThrottled(host, retry_after, self._status_message(url, response.status_code))
+                        metrics.error(error)
+                        raise error
+                if response.status_code != 200:
+                    error = FetchError.from_status(self._status_message(url, response.status_code),
+                                                   response.status_code)
+                    metrics.error(error)
+                    raise error
+                decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+                for chunk in response.iter_content(chunk_size):
+                    yield decoder.decode(chunk)
+                yield decoder.decode(b"", final=True)
+        except (ReadTimeout, ConnectTimeout, ConnectionError, ChunkedEncodingError) as e:
+            error = FetchError.from_connection_error(e)
+            metrics.error(error)
+            raise error
+
+    def close(self):
+        self.session.close()
+        if self.http_cache is not None:
+            self.http_cache.close()
+        if self.negative_cache is not None:
+            self.negative_cache.close()
+
+
+def build_content_extractor(backend=None, request_timeouts=default_request_timeouts, http_cache=None,
+                            negative_cache=None):
+    if (backend or fetch_backend) == "async":
+        from src.async_extractor import AsyncContentExtractor
+        return AsyncContentExtractor(request_timeouts, http_cache=http_cache, negative_cache=negative_cache)
+    return ContentExtractor(request_timeouts, http_cache=http_cache, negative_cache=negative_cache)
+
 
 class AppContentExtractor(ContentExtractor):
 
@@ -68,19 +293,14 @@ class AppContentExtractor(ContentExtractor):
             if seller_url:
                 return (url, f"https://{urlparse(seller_url).netloc}/app-ads.txt", title)
         text = self.request_page(url, text_only=True)
-        json_ld = extruct.extract(text, syntaxes=["json-ld"])["json-ld"][0]
+        is_appstore_page = url.startswith("https://apps.apple.com")
+        json_ld, href = extract_store_page(text, developer_link=is_appstore_page)
 
         title = json_ld.get("name", "-")
         author = json_ld.get("author")
 
-        if url.startswith("https://apps.apple.com"):
-            _soup = BeautifulSoup(text, 'html.parser')
-            _ul = _soup.find('ul', {"class": "inline-list--app-extensions"})
-
-            if _ul:
-                el = _ul.findAll('a')
-                if el:
-                    return (url, f"https://{urlparse(el[0].get('href')).netloc}/app-ads.txt", title)
+        if is_appstore_page and href:
+            return (url, f"https://{urlparse(href).netloc}/app-ads.txt", title)
 
         if author:
             _url = author.get("url")
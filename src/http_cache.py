@@ -0,0 +1,57 @@
+import time
+import zlib
+from src.sqlite_store import SqliteStore
+
+
+class HttpCache(SqliteStore):
+    """
+    Persistent cache of ads.txt responses kept between runs.
+    Entries younger than max_age are served without a request; older ones are revalidated
+    with If-None-Match / If-Modified-Since and a 304 refreshes them in place.
+    """
+    schema = (
+        '''CREATE TABLE IF NOT EXISTS http_cache (url text PRIMARY KEY NOT NULL, final_url text, content_type text, etag text, last_modified text, body blob, fetched_at real NOT NULL)''',
+    )
+
+    def __init__(self, db_path, max_age):
+        super().__init__(db_path)
+        self.max_age = max_age
+        self.fresh_hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def get(self, url):
+        row = self.connection.execute(
+            "SELECT final_url, content_type, etag, last_modified, body, fetched_at FROM http_cache WHERE url=?",
+            (url,)).fetchone()
+        if not row:
+            return
+        final_url, content_type, etag, last_modified, body, fetched_at = row
+        return {"final_url": final_url, "content_type": content_type, "etag": etag, "last_modified": last_modified,
+                "text": zlib.decompress(body).decode(), "fetched_at": fetched_at}
+
+    def is_fresh(self, entry):
+        return time.time() - entry["fetched_at"] < self.max_age
+
+    @staticmethod
+    def conditional_headers(entry):
+        headers = {}
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def put(self, url, final_url, content_type, etag, last_modified, text):
+        with self.connection as con:
+            con.execute(
+                "insert or replace into http_cache (url, final_url, content_type, etag, last_modified, body, fetched_at) values (?,?,?,?,?,?,?);",
+                (url, final_url, content_type, etag, last_modified, zlib.compress(text.encode()), time.time()))
+
+    def touch(self, url):
+        with self.connection as con:
+            con.execute("UPDATE http_cache SET fetched_at=? WHERE url=?", (time.time(), url))
+
+    @property
+    def stats(self):
+        return {"fresh_hits": self.fresh_hits, "revalidated": self.revalidated, "misses": self.misses}
@@ -0,0 +1,87 @@
+import os
+import time
+import hashlib
+from src.sqlite_store import SqliteStore
+
+
+def content_hash(content):
+    return hashlib.sha1(str(content).encode()).hexdigest()
+
+
+class AdsTxtIndex(SqliteStore):
+    """
+    Inverted index over every fetched ads.txt / app-ads.txt.
+    postings maps (ad system, account id, relationship) to the ads.txt url, targets maps the url
+    back to the sheet targets and app ids that resolved to it. A url is only re-indexed when its
+    content hash changes. A target maps to the url it resolved to last; a url no target resolves to any more
+    is dropped together with its postings.
+    """
+    schema = (
+        '''CREATE TABLE IF NOT EXISTS documents (url text PRIMARY KEY NOT NULL, content_hash text NOT NULL, records integer, indexed_at real NOT NULL)''',
+        '''CREATE TABLE IF NOT EXISTS postings (ad_system text NOT NULL, account_id text NOT NULL, relationship text NOT NULL, url text NOT NULL)''',
+        '''CREATE TABLE IF NOT EXISTS targets (url text NOT NULL, target text NOT NULL, app_id text, PRIMARY KEY (url, target))''',
+        '''CREATE INDEX IF NOT EXISTS postings_key ON postings (ad_system, account_id, relationship)''',
+        '''CREATE INDEX IF NOT EXISTS postings_url ON postings (url)''',
+        '''CREATE INDEX IF NOT EXISTS targets_target ON targets (target)''',
+    )
+
+    def __init__(self, db_path, app_db_path=None):
+        super().__init__(db_path)
+        self.app_db_path = app_db_path
+
+    def update(self, url, parsed, digest, target, app_id=None):
+        with self.connection as con:
+            moved = [row[0] for row in con.execute("SELECT url FROM targets WHERE target=? AND url<>?", (target, url))]
+            con.execute("DELETE FROM targets WHERE target=? AND url<>?", (target, url))
+            self._prune(con, moved)
+            con.execute("insert or replace into targets (url, target, app_id) values (?,?,?);", (url, target, app_id))
+            row = con.execute("SELECT content_hash FROM documents WHERE url=?", (url,)).fetchone()
+            if row and row[0] == digest:
+                return False
+            con.execute("DELETE FROM postings WHERE url=?", (url,))
+            con.executemany("insert into postings (ad_system, account_id, relationship, url) values (?,?,?,?);",
+                            [(*key, url) for key in {record.key for record in parsed.records}])
+            con.execute("insert or replace into documents (url, content_hash, records, indexed_at) values (?,?,?,?);",
+                        (url, digest, len(parsed.records), time.time()))
+        return True
+
+    def remove_targets(self, targets):
+        """
+        Forgets targets whose ads.txt no longer resolves, and the urls only they pointed at.
+        """
+        with self.connection as con:
+            urls = set()
+            for target in targets:
+                urls.update(row[0] for row in con.execute("SELECT url FROM targets WHERE target=?", (target,)))
+                con.execute("DELETE FROM targets WHERE target=?", (target,))
+            self._prune(con, urls)
+
+    @staticmethod
+    def _prune(con, urls):
+        for url in urls:
+            if not con.execute("SELECT 1 FROM targets WHERE url=? LIMIT 1", (url,)).fetchone():
+                con.execute("DELETE FROM postings WHERE url=?", (url,))
+                con.execute("DELETE FROM documents WHERE url=?", (url,))
+
+    def query(self, ad_system, account_id=None, relationship=None, limit=None):
+        con = self.connection
+        with_apps = self.app_db_path and os.path.exists(self.app_db_path)
+        if with_apps and not con.execute("SELECT 1 FROM pragma_database_list WHERE name='apps'").fetchone():
+            con.execute("ATTACH DATABASE ? AS apps", (self.app_db_path,))
+
+        sql = "SELECT p.ad_system, p.account_id, p.relationship, p.url, t.target, t.app_id" + \
+              (", a.app_name" if with_apps else ", NULL") + \
+              " FROM postings p LEFT JOIN targets t ON t.url = p.url" + \
+              (" LEFT JOIN apps.apps a ON a.app_id = t.app_id" if with_apps else "") + \
+              " WHERE p.ad_system=?"
+        params = [ad_system.lower()]
+        if account_id is not None:
+            sql += " AND p.account_id=?"
+            params.append(account_id)
+        if relationship is not None:
+            sql += " AND p.relationship=?"
+            params.append(relationship.upper())
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return con.execute(sql, params).fetchall()
@@ -0,0 +1,20 @@
+import json
+from urllib.parse import urlencode
+from src.settings import ITUNES_LOOKUP_URL
+
+
+class ItunesBatchLookup:
+    """
+    Looks up App Store apps through the iTunes lookup endpoint, many ids per request.
+    Requests are grouped by country, since the endpoint answers for a single storefront.
+    """
+
+    def __init__(self, content_extractor, chunk_size=100):
+        self.content_extractor = content_extractor
+        self.chunk_size = chunk_size
+
+    def lookup(self, app_ids, country):
+        url = f"{ITUNES_LOOKUP_URL}?{urlencode({'id': ','.join(app_ids), 'country': country, 'entity': 'software'})}"
+        response = json.loads(self.content_extractor.request_page(url, text_only=True))
+        return {str(result["trackId"]): result for result in response.get("results", [])
+                if result.get("wrapperType") == "software" and "trackId" in result}
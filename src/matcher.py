@@ -0,0 +1,31 @@
+class SearchMatcher:
+    """
+    Search columns compiled once per run.
+    Every column keeps the two option strings the search has always used ("a, b" and "a,b").
+    A body is lowercased once, the distinct options are checked against it once, and only
+    the options actually present are resolved to matching lines.
+    """
+
+    def __init__(self, cols):
+        self.cols = list(cols)
+        self.options = {}
+        for col in self.cols:
+            parts = col.lower().split(",")
+            self.options[col] = (", ".join(parts), ",".join(parts))
+        self.patterns = sorted({option for options in self.options.values() for option in options})
+
+    def search(self, content, lines, default_cols=False):
+        lowered = str(content).lower()
+        present = {pattern for pattern in self.patterns if pattern in lowered}
+
+        if default_cols:
+            return {col: "True" if (options[0] in present or options[1] in present) else "False"
+                    for col, options in self.options.items()}
+
+        lowered_lines = [line.lower() for line in lines] if present else []
+        hits = {pattern: {n for n, line in enumerate(lowered_lines) if pattern in line} for pattern in present}
+        values = {}
+        for col, options in self.options.items():
+            matched = hits.get(options[0], set()) | hits.get(options[1], set())
+            values[col] = "; ".join(lines[n] for n in sorted(matched)) or "-"
+        return values
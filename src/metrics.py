@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from src.errors import FetchError
+from src.ratelimit import HostThrottled
+from src.settings import metrics_buckets
+
+PROMETHEUS_PREFIX = "ads_txt"
+
+
+def error_class(error):
+    """
+    Short, bounded name for what went wrong, used as the errors label.
+    """
+    if isinstance(error, HostThrottled):
+        return "paced" if error.local else "throttled"
+    if isinstance(error, FetchError):
+        if error.failure:
+            return error.failure
+        if error.status_code:
+            return f"http_{error.status_code}"
+        return "transient" if error.retryable else "fetch_error"
+    return type(error).__name__
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # one slot per bound plus the +Inf overflow
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the q-th observation; the largest bound when it overflowed.
+        """
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.bounds[-1]
+
+    def as_dict(self):
+        return {"count": self.count, "sum": round(self.sum, 6), "p50": self.quantile(0.5),
+                "p99": self.quantile(0.99), "buckets": dict(zip([*map(str, self.bounds), "+Inf"], self.counts))}
+
+
+class Metrics:
+    """
+    Counters, error classes and per stage latency histograms shared by every thread of a run.
+    Recording is a lock and a bisect, so it stays on in production runs.
+    """
+
+    def __init__(self, buckets=metrics_buckets):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.counters = {}
+            self.errors = {}
+            self.stages = {}
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def error(self, error):
+        name = error_class(error)
+        with self._lock:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def progress_line(self):
+        with self._lock:
+            stages = " ".join(f"{stage}={histogram.quantile(0.5) * 1000:g}/{histogram.quantile(0.99) * 1000:g}ms"
+                              for stage, histogram in sorted(self.stages.items()))
+            errors = " ".join(f"{name}={count}" for name, count in sorted(self.errors.items()))
+        return f"p50/p99 {stages or '-'} | errors {errors or '-'}"
+
+    def summary(self):
+        with self._lock:
+            return {"started": self.started, "elapsed_seconds": round(time.time() - self.started, 3),
+                    "counters": dict(self.counters), "errors": dict(self.errors),
+                    "stages": {stage: histogram.as_dict() for stage, histogram in sorted(self.stages.items())}}
+
+    def to_prometheus(self):
+        summary = self.summary()
+        lines = [f"# TYPE {PROMETHEUS_PREFIX}_elapsed_seconds gauge",
+                 f"{PROMETHEUS_PREFIX}_elapsed_seconds {summary['elapsed_seconds']}",
+                 f"# TYPE {PROMETHEUS_PREFIX}_events_total counter"]
+        lines += [f'{PROMETHEUS_PREFIX}_events_total{{name="{name}"}} {value}'
+                  for name, value in sorted(summary["counters"].items())]
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_errors_total counter")
+        lines += [f'{PROMETHEUS_PREFIX}_errors_total{{class="{name}"}} {value}'
+                  for name, value in sorted(summary["errors"].items())]
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_stage_seconds histogram")
+        for stage, histogram in summary["stages"].items():
+            cumulative = 0
+            for bound, count in histogram["buckets"].items():
+                cumulative += count
+                lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {histogram["sum"]}')
+            lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """
+        Writes the run summary to path.json and, in Prometheus text format, to path.prom.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(f"{path}.json", "w") as f:
+            json.dump(self.summary(), f, indent=2)
+        with open(f"{path}.prom", "w") as f:
+            f.write(self.to_prometheus())
+
+
+metrics = Metrics()
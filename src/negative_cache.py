@@ -0,0 +1,89 @@
+import time
+import threading
+from urllib.parse import urlparse
+from src.errors import DNS_FAILURE, CONNECT_TIMEOUT
+from src.sqlite_store import SqliteStore
+
+# these take the whole host down, the other classes only the one URL
+HOST_FAILURES = (DNS_FAILURE, CONNECT_TIMEOUT)
+# runs in a row a failure is only noted for before it is skipped: one slow handshake is no dead host
+UNCONFIRMED_STRIKES = {CONNECT_TIMEOUT: 1}
+
+
+class NegativeCache(SqliteStore):
+    """
+    Persistent record of hosts and URLs that keep failing the same way (DNS, connect timeout, 404, non-text).
+    Known failures are answered without a request until their recheck time; every repeat of the same failure
+    moves the recheck further out along intervals. Failures recorded by this run are always probed again,
+    so retries within a run behave as before. A connect timeout is only acted on once it repeats on the next run.
+    """
+    schema = (
+        '''CREATE TABLE IF NOT EXISTS negative_cache (host text NOT NULL, path text NOT NULL, failure text NOT NULL, message text, content_type text, strikes integer NOT NULL, cost real NOT NULL, failed_at real NOT NULL, recheck_at real NOT NULL, PRIMARY KEY (host, path))''',
+    )
+
+    def __init__(self, db_path, intervals):
+        super().__init__(db_path)
+        self.intervals = intervals
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.recorded = 0
+        self.cleared = 0
+        self.saved = 0.0
+
+    @staticmethod
+    def _key(url):
+        parsed = urlparse(url)
+        return parsed.netloc.lower(), parsed.path
+
+    def get(self, url):
+        host, path = self._key(url)
+        # a host-wide failure outranks anything known about the path
+        row = self.connection.execute(
+            "SELECT failure, message, content_type, strikes, cost, failed_at, recheck_at FROM negative_cache WHERE host=? AND path IN ('', ?) ORDER BY path LIMIT 1",
+            (host, path)).fetchone()
+        if not row:
+            return
+        failure, message, content_type, strikes, cost, failed_at, recheck_at = row
+        return {"failure": failure, "message": message, "content_type": content_type, "strikes": strikes,
+                "cost": cost, "failed_at": failed_at, "recheck_at": recheck_at}
+
+    def is_due(self, entry):
+        return entry["recheck_at"] <= time.time() or entry["failed_at"] >= self.started_at
+
+    def hit(self, entry):
+        with self._lock:
+            self.hits += 1
+            self.saved += entry["cost"]
+
+    def record(self, url, failure, message, cost, content_type=None):
+        host, path = self._key(url)
+        if failure in HOST_FAILURES:
+            path = ""
+        now = time.time()
+        with self.connection as con:
+            row = con.execute("SELECT failure, strikes, failed_at FROM negative_cache WHERE host=? AND path=?",
+                              (host, path)).fetchone()
+            if row and row[2] >= self.started_at:
+                # retries of the same target within one run count once
+                return
+            strikes = row[1] + 1 if row and row[0] == failure else 1
+            confirmed = strikes - UNCONFIRMED_STRIKES.get(failure, 0)
+            recheck_at = now + self.intervals[min(confirmed, len(self.intervals)) - 1] if confirmed > 0 else now
+            con.execute(
+                "insert or replace into negative_cache (host, path, failure, message, content_type, strikes, cost, failed_at, recheck_at) values (?,?,?,?,?,?,?,?,?);",
+                (host, path, failure, message, content_type, strikes, cost, now, recheck_at))
+        with self._lock:
+            self.recorded += 1
+
+    def clear(self, url):
+        host, path = self._key(url)
+        with self.connection as con:
+            con.execute("DELETE FROM negative_cache WHERE host=? AND path IN ('', ?)", (host, path))
+        with self._lock:
+            self.cleared += 1
+
+    @property
+    def stats(self):
+        return {"hits": self.hits, "recorded": self.recorded, "cleared": self.cleared,
+                "saved_seconds": round(self.saved, 1)}
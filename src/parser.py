@@ -0,0 +1,86 @@
+VARIABLES = ("CONTACT", "SUBDOMAIN", "OWNERDOMAIN", "MANAGERDOMAIN", "INVENTORYPARTNERDOMAIN")
+RELATIONSHIPS = ("DIRECT", "RESELLER")
+
+
+class AdsTxtRecord:
+    __slots__ = ("domain", "account_id", "relationship", "cert_authority_id", "verified")
+
+    def __init__(self, domain, account_id, relationship, cert_authority_id=None):
+        self.domain = domain
+        self.account_id = account_id
+        self.relationship = relationship
+        self.cert_authority_id = cert_authority_id
+        # set by the sellers.json verification: True / False, None when it could not be checked
+        self.verified = None
+
+    @property
+    def key(self):
+        return self.domain, self.account_id, self.relationship
+
+    def __eq__(self, other):
+        return isinstance(other, AdsTxtRecord) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return f"AdsTxtRecord({self.domain}, {self.account_id}, {self.relationship}, {self.cert_authority_id})"
+
+
+class AdsTxtFile:
+    """
+    Parsed ads.txt / app-ads.txt body.
+    lines holds the non-empty lines exactly as the search has always seen them, records the
+    data lines, variables the CONTACT/SUBDOMAIN/... declarations and malformed the count of
+    lines that are neither.
+    """
+    __slots__ = ("lines", "records", "variables", "malformed")
+
+    def __init__(self):
+        self.lines = []
+        self.records = []
+        self.variables = {}
+        self.malformed = 0
+
+    def find(self, domain, account_id=None, relationship=None):
+        domain = domain.lower()
+        return [record for record in self.records
+                if record.domain == domain
+                and (account_id is None or record.account_id == account_id)
+                and (relationship is None or record.relationship == relationship.upper())]
+
+
+def parse_ads_txt(content):
+    parsed = AdsTxtFile()
+    lines, records, variables = parsed.lines, parsed.records, parsed.variables
+    for raw in str(content).split("\n"):
+        if not raw.strip():
+            continue
+        line = raw.strip("\r")
+        lines.append(line)
+
+        data = line.split("#", 1)[0].strip()
+        if not data:
+            continue
+
+        name, sep, value = data.partition("=")
+        if sep and "," not in name:
+            # unknown variables are ignored, as the spec asks
+            name = name.strip().upper()
+            if name in VARIABLES:
+                variables.setdefault(name, []).append(value.strip())
+            continue
+
+        fields = data.split(",")
+        if len(fields) < 3:
+            parsed.malformed += 1
+            continue
+        domain, account_id, relationship = fields[0].strip().lower(), fields[1].strip(), fields[2].strip().upper()
+        # extension data after a ';' is not part of the relationship field
+        relationship = relationship.split(";", 1)[0].strip()
+        if not domain or not account_id or relationship not in RELATIONSHIPS:
+            parsed.malformed += 1
+            continue
+        cert_authority_id = (fields[3].split(";", 1)[0].strip() or None) if len(fields) > 3 else None
+        records.append(AdsTxtRecord(domain, account_id, relationship, cert_authority_id))
+    return parsed
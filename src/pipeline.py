@@ -0,0 +1,50 @@
+import time
+from concurrent.futures import wait, FIRST_COMPLETED
+from src.delay_queue import DelayQueue
+from src.retry import retry_policy
+
+
+def run_pipeline(pool, tasks, window, policy=retry_policy):
+    """
+    Runs fn(*args, attempt=n) for every (fn, args) task and yields each result as soon as it is ready.
+    Tasks are pulled lazily so that at most window of them are in flight; every completion tops the window
+    back up. A task only raises errors the policy will retry; those go on a delay queue with backoff (or the
+    throttled host's Retry-After) and are resubmitted once due, so no worker ever sleeps.
+    """
+    tasks = iter(tasks)
+    delayed = DelayQueue()
+    futures = {}
+
+    def submit(task, attempt):
+        fn, args = task
+        futures[pool.submit(fn, *args, attempt=attempt)] = (task, attempt)
+
+    exhausted = False
+    while True:
+        for task, attempt in delayed.pop_ready():
+            submit(task, attempt)
+        while not exhausted and len(futures) < window:
+            task = next(tasks, None)
+            if task is None:
+                exhausted = True
+                break
+            submit(task, 0)
+        if not futures:
+            if not delayed:
+                break
+            time.sleep(delayed.next_delay())
+            continue
+        done, _ = wait(futures, timeout=delayed.next_delay(), return_when=FIRST_COMPLETED)
+        for future in done:
+            task, attempt = futures.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                if not policy.should_retry(e, attempt):
+                    print(e)
+                    continue
+                delay = policy.delay(e, attempt)
+                print(f"Retrying...  {e}  < {delay:.1f} seconds >")
+                delayed.push((task, policy.next_attempt(e, attempt)), delay)
+                continue
+            yield result
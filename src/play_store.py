@@ -0,0 +1,81 @@
+import re
+import json
+from src.errors import FetchError
+from google_play_scraper.constants.element import ElementSpecs
+from google_play_scraper.constants.request import Formats
+from google_play_scraper.exceptions import NotFoundError
+
+DS5_PATTERN = re.compile(r"AF_initDataCallback\(\{key:\s*'ds:5'.*?data:", re.S)
+DS5_END = ", sideChannel:"
+
+# where google_play_scraper's app() finds the same fields inside ds:5, taken from its own specs so both read
+# the same slots; a spec that moved out of ds:5 turns lookup off and app() is used instead
+FIELDS = {field: tuple(spec.data_map) for field, spec in ElementSpecs.Detail.items()
+          if field in ("title", "developerWebsite", "privacyPolicy") and spec.ds_num == 5}
+
+
+def _nested(data, path):
+    for i in path:
+        data = data[i]
+    return data
+
+
+class PlayStoreDetails:
+    """
+    Reads only title, developerWebsite and privacyPolicy of a Play Store app. The details page is streamed
+    until its ds:5 data block is complete and the rest is never downloaded. lookup returns None when the page
+    no longer looks the way this expects, so the caller can fall back to google_play_scraper's app().
+    """
+
+    def __init__(self, extractor):
+        self.extractor = extractor
+
+    def _read_ds5(self, url):
+        chunks = self.extractor.iter_page(url)
+        buffer, start = "", None
+        try:
+            for chunk in chunks:
+                # only the tail that could complete a marker split across chunks is scanned again
+                scan_from = max(0, len(buffer) - 256)
+                buffer += chunk
+                if start is None:
+                    match = DS5_PATTERN.search(buffer, scan_from)
+                    if not match:
+                        continue
+                    start = match.end()
+                end = buffer.find(DS5_END, max(scan_from, start))
+                if end >= 0:
+                    return buffer[start:end]
+        finally:
+            chunks.close()
+
+    def lookup(self, app_id, lang="en", country="us"):
+        if len(FIELDS) < 3:
+            return
+        # like app(): an app not listed in the country is asked for once more without one
+        for url in (Formats.Detail.build(app_id=app_id, lang=lang, country=country),
+                    Formats.Detail.fallback_build(app_id=app_id, lang=lang)):
+            try:
+                block = self._read_ds5(url)
+                break
+            except FetchError as e:
+                if e.status_code != 404:
+                    raise
+        else:
+            raise NotFoundError("App not found(404).")
+        if not block:
+            return
+        try:
+            data = json.loads(block)
+            result = {"title": _nested(data, FIELDS["title"])}
+        except (ValueError, IndexError, TypeError):
+            return
+        if not result["title"]:
+            return
+        for field in ("developerWebsite", "privacyPolicy"):
+            try:
+                value = _nested(data, FIELDS[field])
+            except (IndexError, TypeError):
+                value = None
+            result[field] = value if isinstance(value, str) else None
+        return result
@@ -0,0 +1,106 @@
+import time
+import threading
+from email.utils import parsedate_to_datetime
+from src.errors import FetchError
+from src.settings import default_rate_limits
+
+
+class HostThrottled(FetchError):
+    """
+    Raised instead of waiting when a host is throttled for longer than the limiter's max_wait,
+    so the caller can work on other hosts and retry this request after retry_after seconds.
+    local is set when the limiter's own pacing held the request back before it was ever sent.
+    """
+
+    def __init__(self, host, retry_after, message="Rate Limit Exceeded", local=False):
+        super().__init__(message, retryable=True)
+        self.host = host
+        self.retry_after = retry_after
+        self.local = local
+
+
+def parse_retry_after(value):
+    if not value:
+        return
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return
+
+
+class _Bucket:
+    __slots__ = ("rate", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+
+class HostRateLimiter:
+    """
+    Token bucket per host with AIMD adaptation of its refill rate: every successful response adds
+    `increase` requests/s up to max_rate, a 429/503 multiplies the rate by `decrease` down to min_rate,
+    and a Retry-After header blocks the host until it has passed.
+    """
+
+    def __init__(self, initial_rate, min_rate, max_rate, increase, decrease, burst, max_wait):
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.burst = burst
+        self.max_wait = max_wait
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.throttled = 0
+
+    def _bucket(self, host):
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = self._buckets[host] = _Bucket(self.initial_rate, self.burst)
+        return bucket
+
+    def _reserve(self, host):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._bucket(host)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * bucket.rate)
+            bucket.updated = now
+            wait = max(bucket.blocked_until - now, (1 - bucket.tokens) / bucket.rate if bucket.tokens < 1 else 0)
+            if wait > self.max_wait:
+                self.throttled += 1
+                raise HostThrottled(host, wait, local=True)
+            bucket.tokens -= 1
+            return wait
+
+    def acquire(self, host):
+        wait = self._reserve(host)
+        if wait > 0:
+            time.sleep(wait)
+
+    def feedback(self, host, status_code, retry_after=None):
+        with self._lock:
+            bucket = self._bucket(host)
+            if status_code in (429, 503):
+                bucket.rate = max(self.min_rate, bucket.rate * self.decrease)
+                delay = parse_retry_after(retry_after)
+                if delay is None:
+                    delay = 1 / bucket.rate
+                bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + delay)
+                return delay
+            if status_code < 400:
+                bucket.rate = min(self.max_rate, bucket.rate + self.increase)
+
+    def rate(self, host):
+        with self._lock:
+            return self._bucket(host).rate
+
+
+host_rate_limiter = HostRateLimiter(**default_rate_limits)
@@ -0,0 +1,172 @@
+import time
+import threading
+from urllib.parse import urlsplit, urlunsplit
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from src.extractor import is_plain_text
+from src.settings import default_variant_race
+from src.sqlite_store import SqliteStore
+from src.utils import normalize_url
+
+# second level labels that are part of the public suffix, e.g. example.co.uk
+SECOND_LEVEL_LABELS = ("co", "com", "net", "org", "gov", "edu", "ac")
+
+
+def root_domain(host):
+    labels = host.split(".")
+    keep = 3 if len(labels) > 2 and len(labels[-1]) == 2 and labels[-2] in SECOND_LEVEL_LABELS else 2
+    return ".".join(labels[-keep:])
+
+
+def url_variants(url):
+    """
+    Candidate locations of the same file, the given URL first: the www / bare host twin,
+    the other scheme, then the root domain when the host is a subdomain.
+    """
+    parts = urlsplit(url)
+    scheme, host = parts.scheme.lower() or "https", parts.netloc.lower()
+    bare = host[4:] if host.startswith("www.") else host
+    twin = bare if host != bare else f"www.{bare}"
+    other = "http" if scheme == "https" else "https"
+    root = root_domain(bare)
+
+    locations = [(scheme, host), (scheme, twin), (other, host), (other, twin)]
+    if root != bare:
+        locations += [(scheme, root), (other, root)]
+    return [urlunsplit((_scheme, _host, parts.path, parts.query, "")) for _scheme, _host in locations]
+
+
+class VariantStore(SqliteStore):
+    """
+    Which variant of an ads.txt URL answered last time, so the next run asks it first.
+    """
+    schema = (
+        '''CREATE TABLE IF NOT EXISTS ads_txt_variants (url text PRIMARY KEY NOT NULL, winner text NOT NULL, resolved_at real NOT NULL)''',
+    )
+
+    def get(self, url):
+        row = self.connection.execute("SELECT winner FROM ads_txt_variants WHERE url=?", (url,)).fetchone()
+        return row and row[0]
+
+    def put(self, url, winner):
+        with self.connection as con:
+            con.execute("insert or replace into ads_txt_variants (url, winner, resolved_at) values (?,?,?);",
+                        (url, winner, time.time()))
+
+
+class VariantResolver:
+    """
+    Fetches an ads.txt from whichever URL variant gives a text/plain answer first, happy eyeballs style:
+    a candidate is started one stagger after the previous one actually began its request (or as soon as
+    one fails) and the first valid response wins. Only the https variants race; the http ones are tried the
+    same way once none of those answered, so a slightly slower https host never loses to its http twin.
+    Requests still queued are cancelled; ones already on the wire are left to finish and ignored. Every
+    candidate goes through request_page, so the http and negative caches apply.
+    """
+
+    def __init__(self, extractor, store=None, stagger=default_variant_race["stagger"]):
+        self.extractor = extractor
+        self.store = store
+        self.stagger = stagger
+        self.pool = ThreadPoolExecutor(max_workers=extractor.max_in_flight or default_variant_race["max_workers"],
+                                       thread_name_prefix="variant")
+        self._lock = threading.Lock()
+        self.resolved = 0
+        self.fallbacks = 0
+        self.raced = 0
+
+    @staticmethod
+    def is_valid(response):
+        _, content_type, _, text = response
+        return is_plain_text(content_type) and bool(text and text.strip())
+
+    def fetch(self, url):
+        """
+        Returns (winning url, request_page response). When no variant is valid, the given URL's own
+        response or error (retryable or not) is what the caller gets, exactly as without the resolver.
+        """
+        key = normalize_url(url)
+        candidates = url_variants(url)
+        primary = candidates[0]
+        remembered = self.store and self.store.get(key)
+        if remembered in candidates:
+            candidates.remove(remembered)
+            candidates.insert(0, remembered)
+
+        responses, errors = {}, {}
+        started = 0
+        for phase in ([c for c in candidates if c.startswith("https://")],
+                      [c for c in candidates if not c.startswith("https://")]):
+            won = self._race(phase, responses, errors)
+            started += won[2] if won else len(phase)
+            if won:
+                self._won(key, primary, won[0], remembered, started)
+                return won[:2]
+
+        if primary in responses:
+            return primary, responses[primary]
+        raise errors[primary]
+
+    def _race(self, candidates, responses, errors):
+        """
+        (winner, response, candidates started) for the first valid response among candidates, None when there
+        is none; every other response or error is left in responses / errors.
+        """
+        futures = {}
+        started = 0
+        advance = True
+        running = None
+        while started < len(candidates) or futures:
+            if advance and started < len(candidates):
+                # resolved with the time the candidate left the pool queue, which is where its stagger starts
+                running = Future()
+                futures[self.pool.submit(self._request, candidates[started], running)] = candidates[started]
+                started += 1
+            waiting, timeout = list(futures), None
+            if started < len(candidates):
+                if running.done():
+                    timeout = max(0.0, running.result() + self.stagger - time.monotonic())
+                else:
+                    waiting.append(running)
+            done, _ = wait(waiting, timeout=timeout, return_when=FIRST_COMPLETED)
+            # only the newest candidate getting a worker is not a reason to start the next one yet
+            advance = not done or done != {running}
+            for future in done:
+                candidate = futures.pop(future, None)
+                if candidate is None:
+                    continue
+                try:
+                    response = future.result()
+                except Exception as e:
+                    # any failure of one variant, TooManyRedirects included, only rules out that variant
+                    errors[candidate] = e
+                    continue
+                if self.is_valid(response):
+                    self._cancel(futures)
+                    return candidate, response, started
+                responses[candidate] = response
+
+    def _request(self, url, running):
+        running.set_result(time.monotonic())
+        return self.extractor.request_page(url)
+
+    @staticmethod
+    def _cancel(futures):
+        for future in futures:
+            future.cancel()
+
+    def _won(self, key, primary, winner, remembered, started):
+        with self._lock:
+            self.resolved += 1
+            self.fallbacks += winner != primary
+            self.raced += started > 1
+        if self.store and winner != remembered:
+            self.store.put(key, winner)
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        if self.store:
+            self.store.close()
+
+    @property
+    def stats(self):
+        return {"resolved": self.resolved, "fallbacks": self.fallbacks, "raced": self.raced}
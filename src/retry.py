@@ -0,0 +1,37 @@
+import random
+from src.errors import is_retryable
+from src.ratelimit import HostThrottled
+from src.settings import default_retry
+
+
+class RetryPolicy:
+    """
+    Which failed attempts are worth another try and how long to wait before it.
+    Retryable errors back off exponentially with jitter; a throttled host gets its own,
+    larger attempt budget and waits exactly as long as it asked. A request the local rate limiter held back
+    never reached the host, so it is always retried and does not use up an attempt.
+    """
+
+    def __init__(self, retries, throttle_retries, base_delay, max_delay):
+        self.retries = retries
+        self.throttle_retries = throttle_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, error, attempt):
+        if attempt is None or not is_retryable(error):
+            return False
+        if isinstance(error, HostThrottled) and error.local:
+            return True
+        return attempt < (self.throttle_retries if isinstance(error, HostThrottled) else self.retries)
+
+    def next_attempt(self, error, attempt):
+        return attempt if isinstance(error, HostThrottled) and error.local else attempt + 1
+
+    def delay(self, error, attempt):
+        if isinstance(error, HostThrottled):
+            return error.retry_after
+        return min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+retry_policy = RetryPolicy(**default_retry)
@@ -0,0 +1,70 @@
+import heapq
+import time
+from datetime import datetime as dt
+
+RECHECK_NOTES = ('Could not parse app store response for ID',)
+
+
+class RefreshScheduler:
+    """
+    Decides which known apps are due for a metadata refresh.
+    An app's ttl shrinks with how often its name/domain changed in past refreshes and is shorter
+    for rows carrying an error note; apps are handed out most-overdue first (staleness / ttl) and
+    only until the request or time budget of the run is used up. Apps not in the db always go first.
+    """
+
+    def __init__(self, ttl, min_ttl, error_ttl, max_requests=None, time_budget=None):
+        self.ttl = ttl
+        self.min_ttl = min_ttl
+        self.error_ttl = error_ttl
+        self.max_requests = max_requests
+        self.time_budget = time_budget
+
+    def app_ttl(self, row, changes=0):
+        notes = row[7]
+        if notes:
+            if any(note in notes for note in RECHECK_NOTES):
+                return 0
+            return self.error_ttl
+        return max(self.min_ttl, self.ttl / (1 + changes))
+
+    @staticmethod
+    def staleness(row, now):
+        try:
+            return now - dt.fromisoformat(str(row[6])).timestamp()
+        except ValueError:
+            return float("inf")
+
+    def priority(self, row, changes, now):
+        ttl = self.app_ttl(row, changes)
+        return float("inf") if ttl <= 0 else self.staleness(row, now) / ttl
+
+    def due(self, app_requests, apps, volatility):
+        """
+        Yields the app requests to refresh, new apps first and then by descending priority,
+        stopping once the budget is spent.
+        """
+        now = time.time()
+        heap = []
+        for n, app_request in enumerate(app_requests):
+            row = apps.get(app_request.app_id)
+            if not row:
+                heap.append((float("-inf"), n, app_request))
+                continue
+            priority = self.priority(row, volatility.get(app_request.app_id, 0), now)
+            if priority >= 1:
+                heap.append((-priority, n, app_request))
+        heapq.heapify(heap)
+        print(f"{len(heap)} of {len(app_requests)} apps due for refresh")
+
+        started = time.monotonic()
+        handed_out = 0
+        while heap:
+            if self.max_requests is not None and handed_out >= self.max_requests:
+                print(f"request budget of {self.max_requests} reached, {len(heap)} apps left for the next run")
+                return
+            if self.time_budget is not None and time.monotonic() - started >= self.time_budget:
+                print(f"time budget of {self.time_budget}s reached, {len(heap)} apps left for the next run")
+                return
+            handed_out += 1
+            yield heapq.heappop(heap)[2]
@@ -1,28 +1,37 @@
-import os
 import threading
-import time
-import hashlib
-from src.settings import default_request_timeouts
-from src.utils import get_url_category, validate_bundle_id
-from src.extractor import AppContentExtractor, ContentExtractor
-from itunes_app_scraper.scraper import AppStoreException
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from src.settings import default_request_timeouts, default_body_cache
+from src.utils import get_url_category, validate_bundle_id, normalize_url
+from src.cache import BodyCache
+from src.errors import is_retryable
+from src.singleflight import SingleFlight
+from src.extractor import AppContentExtractor, build_content_extractor
+from src.resolver import VariantResolver
 
 
 class AdsDotTxtScraper:
-    store = {}
-    state = {}
+    store = BodyCache(**default_body_cache)
+    flight = SingleFlight()
     rlock = threading.RLock()
+    wait_timeout = 120
 
     def __init__(self, config):
         self.__parse_config(config)
-        self.content_extractor = ContentExtractor(self.request_timeouts if config else default_request_timeouts)
+        self.content_extractor = build_content_extractor(
+            config.get("fetch_backend"), getattr(self, "request_timeouts", default_request_timeouts),
+            http_cache=config.get("http_cache"), negative_cache=config.get("negative_cache"))
+        variants = config.get("variants")
+        self.resolver = variants and VariantResolver(self.content_extractor, variants)
         self.app_content_extractor = AppContentExtractor()
 
     def __parse_config(self, config):
         for k, v in config.items():
             setattr(self, k, v)
 
-    def __build_target(self, target):
+    def build_target(self, target):
+        """
+        (target url, ads.txt url, app name) for a site url, store url or bundle id; None when it is none of them.
+        """
         _target = get_url_category(target)
 
         if _target:
@@ -33,71 +42,34 @@ class AdsDotTxtScraper:
             _target = validate_bundle_id(target)
             return self.app_content_extractor.process(_target) if _target else None
 
-    def get_cache_file_name(self, a_url):
-        return f"temp/{hashlib.md5(a_url.encode()).hexdigest()}.txt"
+    def _get_ads_txt(self, key, a_url):
+        # runs once per url at a time under the single-flight, so a cached result is re-checked here
+        cached = self.store.get(key)
+        if isinstance(cached, Exception):
+            raise cached
+        if cached:
+            return cached
 
-    def get_cached_ads_txt_contents(self, a_url):
-        file_name = self.get_cache_file_name(a_url)
-        with open(file_name) as fp:
-            return fp.read()
-
-    def cache_ads_txt_file(self, a_url, contents):
-        file_name = self.get_cache_file_name(a_url)
-        os.makedirs('temp', exist_ok=True)
-        with open(file_name, 'w') as fp:
-            fp.write(contents)
-        return file_name
+        try:
+            if self.resolver:
+                a_url, (is_https, content_type, _url, text) = self.resolver.fetch(a_url)
+            else:
+                is_https, content_type, _url, text = self.content_extractor.request_page(a_url)
+        except RuntimeError as e:
+            # transient failures (throttling, timeouts, 5xx) are left to the retry queue, not cached
+            if not is_retryable(e):
+                self.store.put(key, e)
+            raise
+        self.store.put(key, (is_https, content_type, text, a_url))
+        return is_https, content_type, text, a_url
 
     def scrape(self, t_url, app_name, a_url):
-        # try:
-        #     _target = self.__build_target(target)
-        # except (AppStoreException, RuntimeError) as e:
-        #     return '-', '-', None, e
-        #
-        # if not _target:
-        #     return
-
-        # t_url, a_url, app_name = _target
-        if a_url in self.state:
-            while self.state[a_url]['code'] == 1:  # Queued
-                if int(time.time()) - self.state[a_url]['ts'] > 120:
-                    with self.rlock:
-                        self.state[a_url].update({'code': 2, 'e': RuntimeError("Timeout while waiting for response.")})
-                    return t_url, app_name, None, self.state[a_url]['e']
-                time.sleep(0.1)
-                # print(f"waiting for {a_url}")
-            if self.state[a_url]['code'] == 2:  # Failed
-                return t_url, app_name, None, self.state[a_url]['e']
-        else:
-            with self.rlock:
-                self.state[a_url] = {'code': 1, 'ts': int(time.time())}
-                # print(f"url queued {a_url}")
-
-        if a_url not in self.store:
-            try:
-                response = self.content_extractor.request_page(a_url)
-                # if not response:
-                #     print(f"failed to get {a_url}")
-                is_https, content_type, _url, text = response
-                with self.rlock:
-                    self.cache_ads_txt_file(a_url, text)
-                    self.store[a_url] = (is_https, content_type)
-                    self.state[a_url].update({'code': 0})  # Success
-                    return t_url, app_name, (is_https, content_type, a_url, text), None
-            except RuntimeError as e:
-                # print(f'error while getting {a_url}', e)
-                with self.rlock:
-                    self.store[a_url] = None
-                    self.state[a_url].update({'code': 2, 'e': e})
-                return t_url, app_name, None, e
-
-        # if not self.store.get(a_url):
-        #     print(f"Retrying...  {a_url}  < 2 seconds >")
-        #     time.sleep(2)
-        #     self.store[a_url] = self.content_extractor.request_page(a_url)
-        if self.store[a_url]:
-            is_https, content_type = self.store[a_url]
-            contents = self.get_cached_ads_txt_contents(a_url)
-            return t_url, app_name, (is_https, content_type, a_url, contents), None
-
-        return t_url, app_name, None, self.state[a_url]['e']
+        key = normalize_url(a_url)
+        try:
+            is_https, content_type, text, a_url = self.flight.do(key, self._get_ads_txt, key, a_url,
+                                                                  timeout=self.wait_timeout)
+        except FutureTimeoutError:
+            return t_url, app_name, None, RuntimeError("Timeout while waiting for response.")
+        except RuntimeError as e:
+            return t_url, app_name, None, e
+        return t_url, app_name, (is_https, content_type, a_url, text), None
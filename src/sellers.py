@@ -0,0 +1,69 @@
+import json
+
+# relationship a seller's own ads.txt line should declare for each sellers.json seller_type
+EXPECTED_RELATIONSHIPS = {
+    "PUBLISHER": {"DIRECT"},
+    "INTERMEDIARY": {"RESELLER"},
+    "BOTH": {"DIRECT", "RESELLER"},
+}
+
+MATCHED = "matched"
+MISSING = "missing"
+RELATIONSHIP_MISMATCH = "relationship mismatch"
+DOMAIN_DOWN = "domain down"
+NO_DOMAIN = "no domain"
+
+
+def load_sellers(path):
+    with open(path) as f:
+        try:
+            data = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"{path} is not valid JSON: {e}")
+    return data
+
+
+def ad_system_domain(sellers_json):
+    email = sellers_json.get("contact_email") or ""
+    return email.rpartition("@")[2].lower() or None
+
+
+class SellersIndex:
+    """
+    sellers.json loaded once and indexed by seller domain, so each publisher's ads.txt is
+    fetched once and all of its sellers are checked with dict lookups.
+    """
+
+    def __init__(self, sellers_json):
+        self.by_domain = {}
+        self.without_domain = []
+        for seller in sellers_json.get("sellers", []):
+            domain = (seller.get("domain") or "").strip().lower()
+            if domain:
+                self.by_domain.setdefault(domain, []).append(seller)
+            else:
+                self.without_domain.append(seller)
+
+    @property
+    def domains(self):
+        return list(self.by_domain)
+
+
+def declared_accounts(parsed_files, ad_system):
+    """account_id -> relationships declared for ad_system across the given parsed files"""
+    accounts = {}
+    for parsed in parsed_files:
+        for record in parsed.records:
+            if record.domain == ad_system:
+                accounts.setdefault(record.account_id, set()).add(record.relationship)
+    return accounts
+
+
+def check_seller(seller, accounts):
+    seller_id = str(seller.get("seller_id") or "").strip()
+    declared = accounts.get(seller_id)
+    if not declared:
+        return MISSING, ""
+    expected = EXPECTED_RELATIONSHIPS.get((seller.get("seller_type") or "").upper(), {"DIRECT", "RESELLER"})
+    status = MATCHED if declared & expected else RELATIONSHIP_MISMATCH
+    return status, ", ".join(sorted(declared))
@@ -0,0 +1,163 @@
+import re
+import json
+import time
+import threading
+from src.singleflight import SingleFlight
+from src.sqlite_store import SqliteStore
+
+SELLERS_ARRAY = re.compile(r'"sellers"\s*:\s*\[')
+SKIPPABLE = " \t\r\n,"
+MAX_PENDING_CHARS = 8 * 1024 * 1024
+
+
+def iter_sellers(chunks):
+    """
+    Yields the entries of a sellers.json "sellers" array as they arrive, decoding one object at a
+    time so a multi-hundred-megabyte file never has to be held in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    in_array = False
+    for chunk in chunks:
+        buffer += chunk
+        if not in_array:
+            match = SELLERS_ARRAY.search(buffer)
+            if not match:
+                buffer = buffer[-64:]
+                continue
+            buffer = buffer[match.end():]
+            in_array = True
+
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in SKIPPABLE:
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if buffer[pos] == "]":
+                return
+            try:
+                seller, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # incomplete object, wait for the next chunk
+                break
+            if isinstance(seller, dict):
+                yield seller
+        buffer = buffer[pos:]
+        if len(buffer) > MAX_PENDING_CHARS:
+            raise RuntimeError("Malformed sellers.json")
+
+
+class SellersJsonCache(SqliteStore):
+    """
+    seller_id -> (seller_type, domain) for every ad system whose sellers.json was fetched,
+    kept on disk for ttl seconds and shared by all worker threads.
+    A new sellers.json is streamed into a staging table and only replaces the cached one once it was read
+    completely, so a fetch failing halfway leaves the previous index intact.
+    """
+    schema = (
+        '''CREATE TABLE IF NOT EXISTS sellers_json (ad_system text PRIMARY KEY NOT NULL, sellers integer, fetched_at real NOT NULL)''',
+        '''CREATE TABLE IF NOT EXISTS sellers_json_entries (ad_system text NOT NULL, seller_id text NOT NULL, seller_type text, domain text, PRIMARY KEY (ad_system, seller_id))''',
+        '''CREATE TABLE IF NOT EXISTS sellers_json_staging (ad_system text NOT NULL, seller_id text NOT NULL, seller_type text, domain text, PRIMARY KEY (ad_system, seller_id))''',
+    )
+
+    def __init__(self, db_path, ttl):
+        super().__init__(db_path)
+        self.ttl = ttl
+
+    def cached_sellers(self, ad_system, stale=False):
+        row = self.connection.execute(
+            "SELECT sellers, fetched_at FROM sellers_json WHERE ad_system=?", (ad_system,)).fetchone()
+        if row and (stale or time.time() - row[1] < self.ttl):
+            return row[0]
+
+    def replace(self, ad_system, sellers, batch_size=5000):
+        con = self.connection
+        self._discard_staged(ad_system)
+        try:
+            batch = []
+            for seller in sellers:
+                seller_id = str(seller.get("seller_id") or "").strip()
+                if not seller_id:
+                    continue
+                batch.append((ad_system, seller_id, seller.get("seller_type"), seller.get("domain")))
+                if len(batch) >= batch_size:
+                    self._stage(batch)
+                    batch = []
+            self._stage(batch)
+        except BaseException:
+            self._discard_staged(ad_system)
+            raise
+        with con:
+            con.execute("DELETE FROM sellers_json_entries WHERE ad_system=?", (ad_system,))
+            count = con.execute(
+                "INSERT INTO sellers_json_entries (ad_system, seller_id, seller_type, domain) "
+                "SELECT ad_system, seller_id, seller_type, domain FROM sellers_json_staging WHERE ad_system=?",
+                (ad_system,)).rowcount
+            con.execute("DELETE FROM sellers_json_staging WHERE ad_system=?", (ad_system,))
+            con.execute("insert or replace into sellers_json (ad_system, sellers, fetched_at) values (?,?,?);",
+                        (ad_system, count, time.time()))
+        return count
+
+    def _stage(self, batch):
+        with self.connection as con:
+            con.executemany(
+                "insert or replace into sellers_json_staging (ad_system, seller_id, seller_type, domain) values (?,?,?,?);",
+                batch)
+
+    def _discard_staged(self, ad_system):
+        with self.connection as con:
+            con.execute("DELETE FROM sellers_json_staging WHERE ad_system=?", (ad_system,))
+
+    def lookup(self, ad_system, seller_id):
+        return self.connection.execute(
+            "SELECT seller_type, domain FROM sellers_json_entries WHERE ad_system=? AND seller_id=?",
+            (ad_system, seller_id)).fetchone()
+
+
+class SellersVerifier:
+    """
+    Marks parsed ads.txt records as verified when their account id is listed in the ad system's
+    own sellers.json. Each sellers.json is fetched at most once per run.
+    """
+
+    def __init__(self, extractor, cache):
+        self.extractor = extractor
+        self.cache = cache
+        self.flight = SingleFlight()
+        self.available = {}
+        self.rows = []
+        self._lock = threading.Lock()
+
+    def _load(self, ad_system):
+        if ad_system in self.available:
+            return self.available[ad_system]
+        count = self.cache.cached_sellers(ad_system)
+        if count is None:
+            try:
+                chunks = self.extractor.iter_page(f"https://{ad_system}/sellers.json")
+                count = self.cache.replace(ad_system, iter_sellers(chunks))
+            except RuntimeError as e:
+                # an expired index still beats none at all when the new file cannot be read
+                count = self.cache.cached_sellers(ad_system, stale=True) or 0
+                print(f"sellers.json unavailable for {ad_system}: {e}" +
+                      (f", using the {count} sellers cached before" if count else ""))
+        self.available[ad_system] = count > 0
+        return count > 0
+
+    def verify(self, records):
+        for record in records:
+            available = self.available.get(record.domain)
+            if available is None:
+                available = self.flight.do(record.domain, self._load, record.domain)
+            record.verified = self.cache.lookup(record.domain, record.account_id) is not None if available else None
+        return records
+
+    def report(self, targets, a_url, records):
+        unverified = [record for record in self.verify(records) if not record.verified]
+        rows = [{"TARGET": target, "ADS.TXT": a_url, "AD_SYSTEM": record.domain, "ACCOUNT_ID": record.account_id,
+                 "RELATIONSHIP": record.relationship,
+                 "STATUS": "unknown" if record.verified is None else "unverified"}
+                for target in targets for record in unverified]
+        with self._lock:
+            self.rows.extend(rows)
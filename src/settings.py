@@ -8,6 +8,15 @@ DATA_DIR = os.path.join(BASE_DIR, "data")
 
 USER_AGENTS_PATH = os.path.join(DATA_DIR, "user-agents.json")
 CONSTANTS_PATH = os.path.join(DATA_DIR, "constants.json")
+CACHE_DB_PATH = os.path.join(DATA_DIR, "cache.db")
+APP_DB_PATH = os.path.join(DATA_DIR, "app-ads-txt.db")
+INDEX_DB_PATH = os.path.join(DATA_DIR, "ads-txt-index.db")
+SELLERS_PATH = os.path.join(BASE_DIR, "sellers.json")
+
+ITUNES_LOOKUP_URL = os.environ.get("ITUNES_LOOKUP_URL", "https://itunes.apple.com/lookup")
+
+# host:port every page request is sent to instead of the real host, e.g. the benchmarks' stand-in server
+host_override = os.environ.get("HOST_OVERRIDE")
 
 ua = UserAgent(cache_path=USER_AGENTS_PATH)
 
@@ -18,4 +27,47 @@ def get_default_cols():
         return data["default_cols"]
 
 
-default_request_timeouts = {"connect": 1, "read": 2}
+# seconds; dns bounds the name lookup of the async backend, which its connect timeout only starts after
+default_request_timeouts = {"connect": 1, "read": 2, "dns": 3}
+
+# "threads" keeps one blocking request per pool thread, "async" multiplexes requests on a shared event loop
+fetch_backend = os.environ.get("FETCH_BACKEND", "threads")
+default_async_limits = {"connections": 1000, "per_host": 8, "keepalive": 30}
+default_max_workers = {"threads": None, "async": 1000}
+# tasks kept in flight per backend; a little above the worker count so a slot is refilled the moment it frees up
+default_pipeline_window = {"threads": 64, "async": 2000}
+
+# decoded ads.txt bodies kept in memory; evicted entries go to spill_dir when it is set
+default_body_cache = {"max_entries": 20000, "max_bytes": 256 * 1024 * 1024,
+                      "spill_dir": os.environ.get("BODY_CACHE_SPILL_DIR")}
+
+# ads.txt responses younger than this are reused as is, older ones are revalidated with a conditional GET
+http_cache_max_age = int(os.environ.get("HTTP_CACHE_MAX_AGE", 6 * 60 * 60))
+
+# ads.txt URL variants are raced this many seconds apart on a pool of their own, sized to what the fetch backend
+# can carry at once; max_workers only applies to backends without a limit of their own
+default_variant_race = {"stagger": float(os.environ.get("VARIANT_STAGGER", 0.5)), "max_workers": 256}
+
+# ads.txt bodies are read in chunks and dropped once they grow past this many bytes
+max_ads_txt_bytes = int(os.environ.get("MAX_ADS_TXT_BYTES", 10 * 1024 * 1024))
+
+# a URL or host failing the same way again is only re-probed after the next of these intervals; ads_txt runs weekly,
+# so even the first one outlasts the gap between two runs and a known failure is skipped at least once
+negative_cache_intervals = [days * 24 * 60 * 60 for days in (8, 15, 30, 60)]
+
+# sellers.json indexes fetched for verification are reused for this long
+sellers_json_ttl = int(os.environ.get("SELLERS_JSON_TTL", 7 * 24 * 60 * 60))
+
+# known apps are refreshed once their ttl (seconds) expires; the ttl shrinks for apps whose details change often
+app_refresh_ttls = {"ttl": 14 * 24 * 60 * 60, "min_ttl": 2 * 24 * 60 * 60, "error_ttl": 3 * 24 * 60 * 60}
+
+# per host request rate (requests/s), adapted on 429/503; waits longer than max_wait seconds are deferred
+default_rate_limits = {"initial_rate": 5.0, "min_rate": 0.2, "max_rate": 50.0, "increase": 0.5, "decrease": 0.5,
+                       "burst": 5, "max_wait": 0.5}
+
+# failed targets are retried later from a delay queue; only timeouts, resets, 5xx and throttling are retried
+default_retry = {"retries": 2, "throttle_retries": 5, "base_delay": 2.0, "max_delay": 60.0}
+
+# upper bounds (seconds) of the per stage latency histograms, and how often the progress line is printed
+metrics_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+metrics_interval = int(os.environ.get("METRICS_INTERVAL", 30))
@@ -0,0 +1,116 @@
+import csv
+import json
+import os
+import time
+import zlib
+import threading
+from src.sqlite_store import SqliteStore
+
+ADDED = "ADDED"
+REMOVED = "REMOVED"
+RELATIONSHIP_CHANGED = "RELATIONSHIP_CHANGED"
+
+
+def diff_records(previous, records):
+    """
+    Line level diff between the record keys of the last snapshot and freshly parsed records.
+    Returns (change, ad_system, account_id, relationship, previous relationship) tuples.
+    """
+    before, after = {}, {}
+    for domain, account_id, relationship in previous:
+        before.setdefault((domain, account_id), set()).add(relationship)
+    for record in records:
+        after.setdefault((record.domain, record.account_id), set()).add(record.relationship)
+
+    changes = []
+    for pair in sorted(after.keys() - before.keys()):
+        changes.extend((ADDED, *pair, relationship, "") for relationship in sorted(after[pair]))
+    for pair in sorted(before.keys() - after.keys()):
+        changes.extend((REMOVED, *pair, "", relationship) for relationship in sorted(before[pair]))
+    for pair in sorted(after.keys() & before.keys()):
+        if after[pair] != before[pair]:
+            changes.append((RELATIONSHIP_CHANGED, *pair, "/".join(sorted(after[pair])), "/".join(sorted(before[pair]))))
+    return changes
+
+
+class SnapshotStore(SqliteStore):
+    """
+    Last seen state of every ads.txt url: its content hash, record keys and the row values the
+    search produced for it under search_key (a hash of the search columns).
+    """
+    schema = (
+        '''CREATE TABLE IF NOT EXISTS snapshots (url text PRIMARY KEY NOT NULL, content_hash text NOT NULL, search_key text NOT NULL, records blob NOT NULL, found blob, taken_at real NOT NULL)''',
+    )
+
+    def get(self, url):
+        row = self.connection.execute(
+            "SELECT content_hash, search_key, records, found FROM snapshots WHERE url=?", (url,)).fetchone()
+        if not row:
+            return
+        digest, search_key, records, found = row
+        return {"content_hash": digest, "search_key": search_key,
+                "records": json.loads(zlib.decompress(records)),
+                "found": found and json.loads(zlib.decompress(found))}
+
+    def put(self, url, digest, search_key, records, found):
+        with self.connection as con:
+            con.execute(
+                "insert or replace into snapshots (url, content_hash, search_key, records, found, taken_at) values (?,?,?,?,?,?);",
+                (url, digest, search_key, zlib.compress(json.dumps([list(record.key) for record in records]).encode()),
+                 found and zlib.compress(json.dumps(found).encode()), time.time()))
+
+
+class ChangeFeed:
+    """
+    Compares every fetched ads.txt with its previous snapshot. An unchanged file hands back the row
+    values of the last run so the search can be skipped; a changed one has its added, removed and
+    relationship-changed lines appended to file_name for each target pointing at it.
+    """
+    fieldnames = ["TARGET", "ADS.TXT", "CHANGE", "AD_SYSTEM", "ACCOUNT_ID", "RELATIONSHIP", "PREVIOUS"]
+
+    def __init__(self, store, file_name, search_key):
+        self.store = store
+        self.search_key = search_key
+        self.file_name = file_name
+        exists = os.path.exists(file_name) and os.path.getsize(file_name) > 0
+        self._file = open(file_name, "a", newline="")
+        self._writer = csv.writer(self._file)
+        if not exists:
+            self._writer.writerow(self.fieldnames)
+        self._lock = threading.Lock()
+        self.new = 0
+        self.unchanged = 0
+        self.changed = 0
+
+    def snapshot(self, url):
+        return self.store.get(url)
+
+    def previous_found(self, snapshot, digest):
+        if snapshot and snapshot["content_hash"] == digest and snapshot["search_key"] == self.search_key:
+            return snapshot["found"]
+
+    def update(self, targets, url, digest, records, found, snapshot):
+        if snapshot and snapshot["content_hash"] == digest:
+            with self._lock:
+                self.unchanged += 1
+            if snapshot["search_key"] != self.search_key or snapshot["found"] != found:
+                self.store.put(url, digest, self.search_key, records, found)
+            return
+        self.store.put(url, digest, self.search_key, records, found)
+        if not snapshot:
+            with self._lock:
+                self.new += 1
+            return
+        changes = diff_records(snapshot["records"], records)
+        with self._lock:
+            self.changed += 1
+            self._writer.writerows([target, url, *change] for target in targets for change in changes)
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+        self.store.close()
+
+    @property
+    def stats(self):
+        return {"new": self.new, "unchanged": self.unchanged, "changed": self.changed}
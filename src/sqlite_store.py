@@ -0,0 +1,41 @@
+import os
+import sqlite3
+import threading
+
+
+class SqliteStore:
+    """
+    Base for the sqlite backed stores under data/.
+    Each thread gets its own connection in WAL mode, so readers never wait on the writer.
+    Subclasses list their CREATE statements in schema.
+    """
+    schema = ()
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self.connection as con:
+            for statement in self.schema:
+                con.execute(statement)
+
+    @property
+    def connection(self):
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+            with self._lock:
+                self._connections.append(con)
+        return con
+
+    def close(self):
+        with self._lock:
+            for con in self._connections:
+                con.close()
+            self._connections.clear()
+        self._local = threading.local()
@@ -0,0 +1,65 @@
+import re
+import json
+import html
+
+APP_EXTENSIONS_CLASS = "inline-list--app-extensions"
+
+# one scan over the page for whichever comes first: a JSON-LD script or the App Store developer links list
+STORE_PAGE_PATTERN = re.compile(
+    r'<script\b[^>]*\btype=["\']?application/ld\+json["\']?[^>]*>(?P<json_ld>.*?)</script\s*>'
+    r'|<ul\b[^>]*\bclass=["\'][^"\']*\b' + APP_EXTENSIONS_CLASS + r'\b[^"\']*["\'][^>]*>(?P<links>.*?)</ul\s*>',
+    re.S | re.I)
+HREF_PATTERN = re.compile(r'<a\b[^>]*?\bhref=["\']([^"\']+)["\']', re.I)
+
+
+def _first_object(data):
+    """
+    A top-level JSON-LD array stands for its items, as in extruct; the first object among them is the one used.
+    Anything that is not an object is treated as not found.
+    """
+    if isinstance(data, list):
+        data = next((item for item in data if isinstance(item, dict)), None)
+    return data if isinstance(data, dict) else None
+
+
+def _load_json_ld(block):
+    try:
+        return _first_object(json.loads(block.strip()))
+    except ValueError:
+        return
+
+
+def scan_store_page(text, developer_link=False):
+    """
+    Single pass over a store page for its first JSON-LD block and, when developer_link is set, the first link
+    of the App Store developer list. Stops as soon as everything asked for is found.
+    Returns (json_ld, href); either is None when the scan did not find it.
+    """
+    json_ld, href = None, None
+    for match in STORE_PAGE_PATTERN.finditer(text):
+        if match.group("json_ld") is not None:
+            if json_ld is None:
+                json_ld = _load_json_ld(match.group("json_ld"))
+        elif href is None:
+            link = HREF_PATTERN.search(match.group("links"))
+            href = link and html.unescape(link.group(1))
+        if json_ld is not None and (href is not None or not developer_link):
+            break
+    return json_ld, href
+
+
+def extract_store_page(text, developer_link=False):
+    """
+    scan_store_page with the old extruct / BeautifulSoup path as fallback for whatever the scanner missed
+    while the page does carry it.
+    """
+    json_ld, href = scan_store_page(text, developer_link)
+    if json_ld is None and "application/ld+json" in text:
+        import extruct
+        json_ld = _first_object(extruct.extract(text, syntaxes=["json-ld"])["json-ld"])
+    if developer_link and href is None and APP_EXTENSIONS_CLASS in text:
+        from bs4 import BeautifulSoup
+        _ul = BeautifulSoup(text, 'html.parser').find('ul', {"class": APP_EXTENSIONS_CLASS})
+        el = _ul and _ul.findAll('a')
+        href = el[0].get('href') if el else None
+    return json_ld or {}, href
@@ -1,5 +1,6 @@
 import re
 import urllib
+from urllib.parse import urlsplit, urlunsplit
 
 
 def regex_checker(text, regex):
@@ -37,3 +38,13 @@ def validate_bundle_id(text):
     except Exception as e:
         print(e)
         print(f"Invalid bundle id: {text}")
+
+
+def normalize_url(url):
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower() or "https"
+    netloc = parts.netloc.lower()
+    if (scheme, netloc.rpartition(":")[2]) in (("http", "80"), ("https", "443")):
+        netloc = netloc.rpartition(":")[0]
+    path = re.sub(r"/{2,}", "/", parts.path) or "/"
+    return urlunsplit((scheme, netloc, path, parts.query, ""))
@@ -0,0 +1,111 @@
+import csv
+import os
+import queue
+import threading
+
+_STOP = object()
+
+
+class _Channel:
+    """
+    List-like handle that forwards append() to the writer queue, so workers can keep calling results.append(...)
+    """
+
+    def __init__(self, _queue, kind):
+        self._queue = _queue
+        self._kind = kind
+
+    def append(self, item):
+        self._queue.put((self._kind, item))
+
+
+class ResultWriter:
+    """
+    Streams result rows and failed targets to disk from a single writer thread as they are produced, and keeps an
+    append-only journal of completed targets next to them. The journal's first line records the files it belongs
+    to, so a resumed run appends to the same files even on a later day. The journal is removed once a run finishes.
+    """
+
+    def __init__(self, journal_path, results_file, failed_file, fieldnames, resume=False, flush_every=100):
+        self.journal_path = journal_path
+        self.completed = set()
+        files = resume and os.path.exists(journal_path) and self._load_journal()
+        if files:
+            results_file, failed_file = files
+            print(f"Resuming {results_file}: {len(self.completed)} targets already done")
+        else:
+            resume = False
+        self.results_file = results_file
+        self.failed_file = failed_file
+        self.flush_every = flush_every
+
+        mode = "a" if resume else "w"
+        self._results = open(results_file, mode, newline="")
+        self._failed = open(failed_file, mode, newline="")
+        self._journal = open(journal_path, mode)
+        self._csv = csv.DictWriter(self._results, fieldnames=fieldnames)
+        if not resume:
+            self._csv.writeheader()
+            self._journal.write(f"{results_file}\t{failed_file}\n")
+            # on disk right away, so a run killed before its first row still leaves a journal it can resume
+            self._flush()
+
+        self._queue = queue.Queue()
+        self.results = _Channel(self._queue, "result")
+        self.failed = _Channel(self._queue, "failed")
+        self.written = 0
+        self._thread = threading.Thread(target=self._write_loop, name="result-writer", daemon=True)
+        self._thread.start()
+
+    def _load_journal(self):
+        with open(self.journal_path) as f:
+            header = f.readline()
+            # a journal killed before its header reached the disk covers nothing; the run starts over
+            if not header.endswith("\n") or header.count("\t") != 1:
+                return
+            # a target is only journaled once its row was queued, so the last line may be cut short by a kill
+            self.completed.update(line.rstrip("\n") for line in f if line.endswith("\n"))
+        results_file, failed_file = header.rstrip("\n").split("\t")
+        return results_file, failed_file
+
+    def is_done(self, target):
+        return str(target) in self.completed
+
+    def mark_done(self, target):
+        self._queue.put(("done", str(target)))
+
+    def _flush(self):
+        self._results.flush()
+        self._failed.flush()
+        self._journal.flush()
+
+    def _write_loop(self):
+        pending = 0
+        while True:
+            kind, item = self._queue.get()
+            if kind is _STOP:
+                break
+            if kind == "result":
+                self._csv.writerow(item)
+                self.written += 1
+            elif kind == "failed":
+                self._failed.write(item + "\n")
+            else:
+                # rows reach the disk before the journal entry that covers them
+                self._results.flush()
+                self._failed.flush()
+                self._journal.write(item + "\n")
+            pending += 1
+            if pending >= self.flush_every or self._queue.empty():
+                self._flush()
+                pending = 0
+        self._flush()
+
+    def close(self, finished=True):
+        self._queue.put((_STOP, None))
+        self._thread.join()
+        self._results.close()
+        self._failed.close()
+        self._journal.close()
+        if finished:
+            os.remove(self.journal_path)
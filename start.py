@@ -2,6 +2,9 @@ import csv
 import time
 from src.settings import get_default_cols
 from src.scraper import AdsDotTxtScraper
+from src.matcher import SearchMatcher
+from src.delay_queue import DelayQueue
+from src.retry import retry_policy
 
 config = {
     ## page request timeouts can be manipulated here
@@ -59,28 +62,37 @@ if not out_file:
 results = []
 failed = []
 fillups = {i: "-" for i in cols}
+matcher = SearchMatcher(cols)
+delayed = DelayQueue()
 _scraper = AdsDotTxtScraper(config)
 
 
-def preprocess(line, trial=1):
+def preprocess(line, attempt=0):
     if not (line and len(line.strip())):
         return
 
     status = True
     _scraped = []
     _check = None
+    error = None
     try:
         # TODO: App store bundle ids whose url has a country code other than "us" won't be available for scraping. Need to pass the full url into the scraper.
-        _scraped = _scraper.scrape(line)
-        _check = _scraped[2]
-    except:
+        _target = _scraper.build_target(line)
+        if _target:
+            t_url, a_url, app_name = _target
+            _scraped = _scraper.scrape(t_url, app_name, a_url)
+            _check = _scraped[2]
+            error = _scraped[3]
+    except Exception as e:
         status = False
+        error = e
 
     if not (status and _check):
-        if trial:
-            print(f"Retrying...  {line}  < 5 seconds >")
-            time.sleep(5)
-            return preprocess(line, trial - 1)
+        if retry_policy.should_retry(error, attempt):
+            delay = retry_policy.delay(error, attempt)
+            print(f"Retrying...  {line}  < {delay:.1f} seconds >")
+            delayed.push((line, retry_policy.next_attempt(error, attempt)), delay)
+            return
 
         results.append({"TARGET": line, "APP_NAME": "-", "URL": "-", "ADS.TXT": "Failed", "IS HTTPS?": "-", **fillups,
                         "REMARKS": "Unable to scrape data."})
@@ -90,12 +102,21 @@ def preprocess(line, trial=1):
     return _scraped
 
 
-for line in data:
-    preprocessed = preprocess(line)
+def pending_lines():
+    # every line once, then retries as they become due; this is the only thread, so it may wait here
+    for line in data:
+        yield line, 0
+    while delayed:
+        time.sleep(delayed.next_delay())
+        yield from delayed.pop_ready()
+
+
+for line, attempt in pending_lines():
+    preprocessed = preprocess(line, attempt)
     if not preprocessed:
         continue
 
-    t_url, app_name, scraped_data = preprocessed
+    t_url, app_name, scraped_data, _ = preprocessed
     is_https, content_type, a_url, content = scraped_data
     if content_type and "text/plain" not in content_type:
         failed.append(line)
@@ -113,15 +134,8 @@ for line in data:
              "REMARKS": f"{no_of_lines} lines only."})
         continue
 
-    r_dict = {"TARGET": line, "APP_NAME": app_name, "URL": t_url, "ADS.TXT": a_url, "IS HTTPS?": is_https}
-    for i in cols:
-        options = (", ".join(i.lower().split(",")), ",".join(i.lower().split(",")))
-        if default_cols:
-            values = "True" if (options[0] in str(content).lower() or options[1] in str(content).lower()) else "False"
-        else:
-            values = "; ".join(
-                filter(lambda x: (options[0] in x.lower() or options[1] in x.lower()), splitted_content)) or "-"
-        r_dict[i] = values
+    r_dict = {"TARGET": line, "APP_NAME": app_name, "URL": t_url, "ADS.TXT": a_url, "IS HTTPS?": is_https,
+              **matcher.search(content, splitted_content, default_cols)}
 
     results.append(r_dict)
 